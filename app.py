@@ -1,15 +1,42 @@
+import gc
 import json
+import os
 
 from flask import Flask, render_template, request
 
+import arab_tools
 import book
+import caches
 import data
+import rules
 from data_types import IJMESProfile, NameProfile, Profile, profile_descriptions
-from trans import transliterate, transliterate_ijmes, transliterate_llm
+from trans import (
+    cached_analysis,
+    render,
+    rerender,
+    schemes,
+    transliterate_ijmes,
+    transliterate_incremental,
+    transliterate_llm,
+    transliterate_many,
+    transliterate_multi,
+)
+from unknown_words import unknown_words
 from vocalization import vocalize
 
 app = Flask(__name__)
 
+# the word analysis can be shared between the workers and restarts
+if analysis_cache := os.environ.get("ANALYSIS_CACHE"):
+    arab_tools.use_persistent_cache(analysis_cache)
+
+# the workers share the lexicons through the page cache
+if mapped_lexicons := os.environ.get("MAPPED_LEXICONS"):
+    data.use_mapped_lexicons(mapped_lexicons)
+# or read them from the databases of arramooz ("arramooz" for the installed ones)
+elif sqlite_lexicons := os.environ.get("SQLITE_LEXICONS"):
+    data.use_sqlite_lexicons(None if sqlite_lexicons == "arramooz" else sqlite_lexicons)
+
 
 # Pages
 @app.route("/")
@@ -73,11 +100,66 @@ def _book():
 def trans():
     """
     Takes a string of Arabic text and settings and returns a transliteration
+
+    The X-Analysis header holds the key for /transliterate/render
     """
     data = json.loads(request.data)
     text = data["text"]
     profile = Profile(**data["profile"])
-    return transliterate(text, profile)
+    key, analysis = cached_analysis(text, profile)
+    return render(analysis, profile), {"X-Analysis": key}
+
+
+@app.route("/transliterate/batch", methods=["POST"])
+def trans_batch():
+    """
+    Takes a list of texts and settings and returns the list of transliterations
+    """
+    data = json.loads(request.data)
+    return transliterate_many(data["texts"], Profile(**data["profile"]))
+
+
+@app.route("/transliterate/render", methods=["POST"])
+def trans_render():
+    """
+    Takes the X-Analysis key of a previous transliteration and settings
+    and returns the transliteration with the new settings or 404 if the text is gone
+    """
+    data = json.loads(request.data)
+    result = rerender(data["analysis"], Profile(**data["profile"]))
+    if result is None:
+        return "", 404
+    return result, {"X-Analysis": data["analysis"]}
+
+
+def incremental_answer(profile_type: type[Profile] | type[NameProfile]) -> dict:
+    """
+    Takes a document id, its whole text and settings and returns what changed since
+    the last request for the document: the sentences in [start:stop] are replaced
+
+    The client sends the revision it has (how many answers it has applied) and
+    how many sentences it holds and gets the next revision back
+    """
+    data = json.loads(request.data)
+    revision = data.get("revision")
+    start, stop, sentences = transliterate_incremental(
+        data["document"],
+        data["text"],
+        profile_type(**data["profile"]),
+        revision=revision,
+        count=data.get("count", 0),
+    )
+    return {
+        "start": start,
+        "stop": stop,
+        "sentences": sentences,
+        "revision": (revision or 0) + 1,
+    }
+
+
+@app.route("/transliterate/incremental", methods=["POST"])
+def trans_incremental():
+    return incremental_answer(Profile)
 
 
 @app.route("/transliterate/names", methods=["POST"])
@@ -85,7 +167,28 @@ def trans_names():
     data = json.loads(request.data)
     text = data["text"]
     profile = NameProfile(**data["profile"])
-    return transliterate(text, profile)
+    key, analysis = cached_analysis(text, profile)
+    return render(analysis, profile), {"X-Analysis": key}
+
+
+@app.route("/transliterate/names/batch", methods=["POST"])
+def trans_names_batch():
+    data = json.loads(request.data)
+    return transliterate_many(data["texts"], NameProfile(**data["profile"]))
+
+
+@app.route("/transliterate/names/render", methods=["POST"])
+def trans_names_render():
+    data = json.loads(request.data)
+    result = rerender(data["analysis"], NameProfile(**data["profile"]))
+    if result is None:
+        return "", 404
+    return result, {"X-Analysis": data["analysis"]}
+
+
+@app.route("/transliterate/names/incremental", methods=["POST"])
+def trans_names_incremental():
+    return incremental_answer(NameProfile)
 
 
 @app.route("/transliterate/ijmes", methods=["POST"])
@@ -112,6 +215,22 @@ def vocalization():
     return vocalize(text)
 
 
+@app.route("/debug/caches")
+def cache_stats():
+    """
+    Returns the size, hits, misses and evictions of every registered cache
+    """
+    return caches.stats()
+
+
+@app.route("/debug/unknown-words")
+def top_unknown_words():
+    """
+    Returns the 100 most common words this worker couldn't analyze
+    """
+    return unknown_words.top(100)
+
+
 @app.route("/feedback", methods=["POST"])
 def feedback():
     with open("feedback.jsonl", "ab") as f:
@@ -119,5 +238,35 @@ def feedback():
     return ""
 
 
+preload_word_count = 2000
+"""How many frequent words `preload` analyzes if there is no table of them"""
+
+
+def preload(word_count: int = preload_word_count):
+    """
+    Loads the lexicons, compiles all rule sets and analyzes the most frequent
+    words ahead of time and then freezes it all for the garbage collector
+
+    For the process that forks the workers (PRELOAD=1 gunicorn --preload app:app),
+    so that the workers share these pages instead of each copying them
+    """
+    for name in data.lexicon_sources:
+        getattr(data, name)
+    rules.build_rule_sets()
+    arab_tools.warm_up(word_count)
+    # builds whatever else the first request would build
+    transliterate_multi(
+        "بسم الله الرحمن الرحيم",
+        {name: scheme.profile() for name, scheme in schemes.items()},
+    )
+    gc.collect()
+    # the collector of a worker doesn't touch (and copy) the frozen objects
+    gc.freeze()
+
+
+if os.environ.get("PRELOAD"):
+    preload()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port="5000", debug=True)
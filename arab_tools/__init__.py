@@ -16,7 +16,8 @@ The files in this module are licensed under the GPL-3.0 License.
 """
 
 import itertools
-from functools import cache
+import os
+from contextlib import suppress
 from typing import Callable, Generator, Literal
 
 import asmai.semdictionary
@@ -34,12 +35,66 @@ from qalsadi.stemmedword import StemmedWord
 from qalsadi.wordcase import WordCase
 
 import data
+from caches import LRUCache, SQLiteCache, cached, estimate_size
 from data_types import Case, Pos, Sentence, Token
+from unknown_words import unknown_words
 
+from .lightstemmer import SharedSegmentation, verify_affix
 from .nounstemmer import stem_noun
 
 remove_i3rab = araby.strip_lastharaka
 
+# the sizes of the registered caches (see caches.stats())
+check_word_cache_size = 2**17
+tag_cache_size = 2**17
+
+analysis_version = "1"
+"""Has to change whenever the result of check_word changes for the same lexicon"""
+persistent_cache: SQLiteCache | None = None
+"""The results of check_word shared by all processes, see `use_persistent_cache`"""
+frequent_words_path = "data/frequent_words.json"
+frequent_words: dict[tuple[str, str], tuple] = {}
+"""
+The precomputed results of check_word for the most frequent words
+(built by tools/build_frequent_words.py)
+"""
+
+
+def analysis_key() -> str:
+    """
+    Precomputed results of check_word are only valid for this key
+    """
+    return f"{analysis_version}-{data.lexicon_version()}"
+
+
+def use_persistent_cache(path: str):
+    """
+    Stores the results of check_word in a SQLite file at `path`
+    that all workers share and that survives restarts
+    """
+    global persistent_cache
+    persistent_cache = SQLiteCache(path, analysis_key(), "persistent_check_word")
+
+
+def load_frequent_words(path: str = frequent_words_path) -> bool:
+    """
+    Loads the table of frequent words if it exists and was built
+    for the current lexicon
+    """
+    if not os.path.exists(path):
+        return False
+    table = data.read(path)
+    if table["version"] != analysis_key():
+        return False
+    frequent_words.update(
+        ((word, tag), tuple(result))  # type: ignore
+        for word, tag, *result in table["words"]
+    )
+    return True
+
+
+load_frequent_words()
+
 
 Tag = Literal["t", "v", "n", "nv"]
 """
@@ -50,22 +105,29 @@ Tag = Literal["t", "v", "n", "nv"]
 """
 
 
+_tags: LRUCache[str, Tag] = LRUCache(tag_cache_size, "tag_word_alone", estimate_size)
+
+
 class WordTagger(naftawayh.wordtag.WordTagger):
     """
     This WordTagger is a subclass of naftawayh.wordtag.WordTagger
     and tries to improve on it by adding the functions tag_word_alone and tag_word
 
-    tag_world_alone is cached using functools.cache
+    tag_word_alone is cached in the "tag_word_alone" cache
 
     tag_word works similarly to the original one_word_tagging
     but doesn't append digits to the tag
     """
 
-    @cache
     def tag_word_alone(self, word: str) -> Tag:
         """
         Tags an Arabic word without any context
         """
+        if (tag := _tags.get(word)) is None:
+            tag = _tags.put(word, self._tag_word_alone(word))
+        return tag
+
+    def _tag_word_alone(self, word: str) -> Tag:
         stripped_word = araby.strip_tashkeel(word)
         if self.is_stopword(stripped_word):
             return "t"
@@ -91,27 +153,50 @@ class WordTagger(naftawayh.wordtag.WordTagger):
         return tag
 
 
-class VerbStemmer(qalsadi.stem_verb.VerbStemmer):
+# the letters ArabicDictionary.word_stamp removes
+_stamp_letters = (
+    araby.ALEF
+    + araby.YEH
+    + araby.HAMZA
+    + araby.ALEF_HAMZA_ABOVE
+    + araby.WAW_HAMZA
+    + araby.YEH_HAMZA
+    + araby.WAW
+    + araby.ALEF_MAKSURA
+    + araby.SHADDA
+    + araby.ALEF_MADDA
+)
+_stamp_table = str.maketrans("", "", _stamp_letters)
+_stamp_table_without_teh = str.maketrans("", "", _stamp_letters + araby.TEH)
+
+
+def verb_stamp(word: str, without_teh: bool = False) -> str:
+    """
+    The same as ArabicDictionary.word_stamp, but with a translation table
+    instead of a regex
+    """
+    # strip the last letter if it is doubled
+    if word[-1:] == word[-2:-1]:
+        word = word[:-1]
+    return word.translate(_stamp_table_without_teh if without_teh else _stamp_table)
+
+
+class VerbStemmer(SharedSegmentation, qalsadi.stem_verb.VerbStemmer):
     def lookup_by_stamp(self, word):
         """
         lookup for word in dict
         """
-        stamp = self.verb_dictionary.word_stamp(word)
-        return data.verb_dict[stamp]
+        return data.verb_dict.get(verb_stamp(word), ())
 
     def exists_as_stamp(self, word):
         """
-        lookup for word in dict
+        Whether the word can be a verb stem.
+        Is called for every candidate, so it's only a set lookup
         """
-        stamp = self.verb_dictionary.word_stamp(word)
-        stamp = stamp.replace(araby.TEH, "")
-        # a verb stamp can't be more than 4 letters
-        if len(stamp) > 4:
-            return False
-        return stamp in data.verb_dict
+        return verb_stamp(word, True) in data.short_verb_stamps
 
 
-class UnknownStemmer(qalsadi.stem_unknown.UnknownStemmer):
+class UnknownStemmer(SharedSegmentation, qalsadi.stem_unknown.UnknownStemmer):
     def lookup_dict(self, word):
         result = []
         if item := data.unknown_dict.get(word):
@@ -121,7 +206,7 @@ class UnknownStemmer(qalsadi.stem_unknown.UnknownStemmer):
         return result
 
 
-class StopWordStemmer(qalsadi.stem_stop.StopWordStemmer):
+class StopWordStemmer(SharedSegmentation, qalsadi.stem_stop.StopWordStemmer):
     def steming_second_level(self, stop, stop2, procletic, encletic_nm):
         """
         Analyze word morphologically by stemming the conjugation affixes.
@@ -165,20 +250,9 @@ class StopWordStemmer(qalsadi.stem_stop.StopWordStemmer):
                 # get the stop and get all its forms from the dict
                 # if the stop has plural suffix, don't look up in
                 # broken plural dictionary
-                if infstop not in self.cache_dict_search:
-                    infstop_foundlist = data.stopword_dict.get(infstop, [])
-                    # _infstop_foundlist = list(map(dict, self.stop_dictionary.lookup(infstop)))
-                    # for x in _infstop_foundlist:
-                    #     x.pop("ID")
-                    # assert _infstop_foundlist == infstop_foundlist, (
-                    #     infstop, _infstop_foundlist, infstop_foundlist
-                    # )
-                    self.cache_dict_search[infstop] = self.create_dict_word(
-                        infstop_foundlist
-                    )
-                else:
-                    infstop_foundlist = self.cache_dict_search[infstop]
-                infstop_form_list.extend(infstop_foundlist)
+                # data.stopword_dict is already what the dictionary lookup
+                # would be cached as, so there is nothing to cache
+                infstop_form_list.extend(data.stopword_dict.get(infstop, []))
             for stop_tuple in infstop_form_list:
                 # stop_tuple = self.stop_dictionary.getEntryById(id)
                 original = stop_tuple["vocalized"]
@@ -274,6 +348,7 @@ class SemanticDictionary(asmai.semdictionary.SemanticDictionary):
 # Fix qalsadi and asmai from here
 qalsadi.stem_verb.VerbStemmer = VerbStemmer
 qalsadi.stem_unknown.UnknownStemmer = UnknownStemmer
+qalsadi.stem_unknown.verify_affix = verify_affix
 qalsadi.stem_stop.StopWordStemmer = StopWordStemmer
 asmai.semdictionary.SemanticDictionary = SemanticDictionary
 
@@ -354,8 +429,45 @@ def _check_word(word: str, tag: str) -> list[StemmedWord]:
 
     return [StemmedWord(w) for w in result]
 
-@cache
 def check_word(word: str, tag: str) -> tuple[str, Pos, Case, bool, str, str, str, bool]:
+    """
+    Analyzes a word of a text and counts it in `unknown_words` if that fails
+    """
+    result = lookup_word(word, tag)
+    if not result[-1]:
+        unknown_words.add(word)
+    return result
+
+
+def lookup_word(
+    word: str, tag: str
+) -> tuple[str, Pos, Case, bool, str, str, str, bool]:
+    """
+    Analyzes a word: from the table of frequent words, the caches
+    or with the stemmers
+    """
+    if (result := frequent_words.get((word, tag))) is not None:
+        return result
+    return cached_check_word(word, tag)
+
+
+@cached("check_word", check_word_cache_size)
+def cached_check_word(
+    word: str, tag: str
+) -> tuple[str, Pos, Case, bool, str, str, str, bool]:
+    if persistent_cache is None:
+        return analyze_word(word, tag)
+    if (result := persistent_cache.get((word, tag))) is None:
+        result = persistent_cache.put((word, tag), analyze_word(word, tag))
+    return result  # type: ignore
+
+
+def analyze_word(
+    word: str, tag: str
+) -> tuple[str, Pos, Case, bool, str, str, str, bool]:
+    """
+    The uncached check_word
+    """
     result = _check_word(word, tag)
     # lemma, pos, case, is_definite, prefix, verb ending, suffix, success
     if not result:
@@ -383,7 +495,7 @@ def check_word(word: str, tag: str) -> tuple[str, Pos, Case, bool, str, str, str
 
         # wa- and fa- prefix
         if letter in "فو" and (not haraka or haraka == data.fatha):
-            result = check_word(join(rasm[1:], harakat[1:]), tag)
+            result = lookup_word(join(rasm[1:], harakat[1:]), tag)
             if result[-1]:  # success
                 return prepend_prefix(result, letter + data.fatha)
             # return (
@@ -393,7 +505,7 @@ def check_word(word: str, tag: str) -> tuple[str, Pos, Case, bool, str, str, str
             # )
         # sa- prefix
         elif letter == "س" and (not haraka or haraka == data.fatha):
-            result = check_word(join(rasm[1:], harakat[1:]), tag)
+            result = lookup_word(join(rasm[1:], harakat[1:]), tag)
             if result[-1] and result[1] == "verb":
                 return prepend_prefix(result, letter + data.fatha)
         # li-, bi-, ka- and then al- prefix
@@ -408,11 +520,11 @@ def check_word(word: str, tag: str) -> tuple[str, Pos, Case, bool, str, str, str
                 ):
                     prefix += "لْ"
                     i += 1
-                result = check_word(join(rasm[i:], harakat[i:]), tag)
+                result = lookup_word(join(rasm[i:], harakat[i:]), tag)
                 if result[-1] and (i == 1 or result[1] == "noun"):
                     return prepend_prefix(result, prefix)
             elif letter == "ك" and (not harakat[i] or harakat[i] == data.fatha):
-                result = check_word(join(rasm[1:], harakat[1:]), tag)
+                result = lookup_word(join(rasm[1:], harakat[1:]), tag)
                 if result[-1]:
                     return prepend_prefix(result, letter + data.fatha)
         elif (
@@ -422,12 +534,9 @@ def check_word(word: str, tag: str) -> tuple[str, Pos, Case, bool, str, str, str
             and rasm[1] == "ل"
             and harakat[1] in " " + data.sukun
         ):
-            result = check_word(join(rasm[2:], harakat[2:]), tag)
+            result = lookup_word(join(rasm[2:], harakat[2:]), tag)
             if result[-1] and result[1] == "noun":
                 return prepend_prefix(result, letter + data.fatha)
-        # debug
-        with open("broken_words.txt", "a", encoding="utf-8") as f:
-            f.write(word + "\n")
         return default_return
     else:
         node = stemnode.StemNode(result, True)
@@ -468,6 +577,37 @@ def check_word(word: str, tag: str) -> tuple[str, Pos, Case, bool, str, str, str
         ) # type: ignore
 
 
+def plausible_tags(word: str) -> list[Tag]:
+    """
+    All tags `tagger.tag_word` can give the word in some context
+    """
+    tag = tagger.tag_word_alone(word)
+    return ["nv", "n", "v", "t"] if tag == "nv" else [tag]
+
+
+def most_frequent_words(count: int) -> list[str]:
+    """
+    The `count` most frequent unvocalized words of data/wordfreq.json
+    """
+    entries = sorted(
+        data.read("data/wordfreq.json"), key=lambda entry: entry["freq"], reverse=True
+    )
+    return [*dict.fromkeys(entry["unvocalized"] for entry in entries)][:count]
+
+
+def warm_up(count: int):
+    """
+    Analyzes the `count` most frequent words with all plausible tags,
+    unless the table of frequent words already answers for them
+    """
+    if frequent_words:
+        return
+    for word in most_frequent_words(count):
+        for tag in plausible_tags(word):
+            with suppress(Exception):
+                lookup_word(word, tag)
+
+
 def check_sentence(
     sentence: Sentence,
 ) -> Generator[tuple[str, Pos, Case, bool, str, str, str, bool], None, None]:
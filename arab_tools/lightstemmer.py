@@ -0,0 +1,97 @@
+"""
+Segmentation for the stemmers in this module
+
+The segmentations of a word only depend on the word and on the affix lists
+of the stemmer, so all stemmers share one bounded cache of them
+"""
+
+import sys
+from typing import Collection, Iterable
+
+import tashaphyne.stemming
+
+from caches import LRUCache
+
+segment_cache_size = 2**16
+
+Segment = tuple[int, int]
+
+
+def _sizeof(key: tuple[int, str], segments: tuple[Segment, ...]) -> int:
+    # cheaper than caches.estimate_size, the integers are small and shared
+    return sys.getsizeof(key[1]) + sys.getsizeof(segments) + 56 * len(segments)
+
+
+_segments: LRUCache[tuple[int, str], tuple[Segment, ...]] = LRUCache(
+    segment_cache_size, "segment", _sizeof
+)
+_affix_lists: dict[tuple[frozenset[str], frozenset[str]], int] = {}
+
+
+class LightStemmer(tashaphyne.stemming.ArabicLightStemmer):
+    """
+    An ArabicLightStemmer whose segmentations are cached
+
+    Unlike the original, `segment` only returns the segmentations
+    (as a tuple in the original order) and doesn't remember the word
+    """
+
+    def __init__(self, prefixes: Collection[str], suffixes: Collection[str]):
+        super().__init__()
+        self.set_prefix_list(prefixes)
+        self.set_suffix_list(suffixes)
+        # stemmers with the same affixes share their entries
+        self._affixes = _affix_lists.setdefault(
+            (frozenset(prefixes), frozenset(suffixes)), len(_affix_lists)
+        )
+
+    @classmethod
+    def like(cls, stemmer: tashaphyne.stemming.ArabicLightStemmer) -> "LightStemmer":
+        """
+        A LightStemmer with the affixes of the given stemmer
+        """
+        return cls(stemmer.prefix_list, stemmer.suffix_list)
+
+    def segment(self, word: str) -> tuple[Segment, ...]:  # type: ignore
+        key = (self._affixes, word)
+        if (segments := _segments.get(key)) is None:
+            segments = _segments.put(key, tuple(super().segment(word)))
+        return segments
+
+
+_affix_pairs: dict[int, tuple[Collection[str], frozenset[tuple[str, str]]]] = {}
+
+
+def affix_pairs(affix_list: Collection[str]) -> frozenset[tuple[str, str]]:
+    """
+    The "prefix-suffix" strings of an affix list as (prefix, suffix) pairs
+    """
+    # the affix lists are constants, but sets aren't hashable
+    if (entry := _affix_pairs.get(id(affix_list))) is None:
+        pairs = frozenset(tuple(affix.split("-", 1)) for affix in affix_list)
+        entry = _affix_pairs[id(affix_list)] = (affix_list, pairs)  # type: ignore
+    return entry[1]
+
+
+def verify_affix(
+    word: str, list_seg: Iterable[Segment], affix_list: Collection[str]
+) -> list[Segment]:
+    """
+    The segmentations of the word whose prefix and suffix are in the affix list
+    """
+    entry = _affix_pairs.get(id(affix_list))
+    pairs = entry[1] if entry else affix_pairs(affix_list)
+    return [s for s in list_seg if (word[: s[0]], word[s[1] :]) in pairs]
+
+
+class SharedSegmentation:
+    """
+    Makes a qalsadi stemmer segment with LightStemmers
+    """
+
+    verify_affix = staticmethod(verify_affix)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.comp_stemmer = LightStemmer.like(self.comp_stemmer)
+        self.conj_stemmer = LightStemmer.like(self.conj_stemmer)
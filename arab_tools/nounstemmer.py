@@ -7,43 +7,29 @@ https://github.com/linuxscout/qalsadi/blob/master/qalsadi/stem_noun.py
 
 """
 
-from functools import cache
+from itertools import product
+from typing import Iterator
 
 import alyahmor.aly_stem_noun_const as SNC
 import alyahmor.noun_affixer
-import tashaphyne.stemming
 from pyarabic import araby
 from qalsadi.wordcase import WordCase
 
 import data
+from caches import cached
 
-comp_stemmer = tashaphyne.stemming.ArabicLightStemmer()
-comp_stemmer.set_prefix_list(SNC.COMP_PREFIX_LIST)
-comp_stemmer.set_suffix_list(SNC.COMP_SUFFIX_LIST)
+from .lightstemmer import LightStemmer, verify_affix
 
-conj_stemmer = tashaphyne.stemming.ArabicLightStemmer()
-conj_stemmer.set_prefix_list(SNC.CONJ_PREFIX_LIST)
-conj_stemmer.set_suffix_list(SNC.CONJ_SUFFIX_LIST)
+vocalize_cache_size = 2**16
+
+comp_stemmer = LightStemmer(SNC.COMP_PREFIX_LIST, SNC.COMP_SUFFIX_LIST)
+conj_stemmer = LightStemmer(SNC.CONJ_PREFIX_LIST, SNC.CONJ_SUFFIX_LIST)
 
 generator = alyahmor.noun_affixer.noun_affixer()
 
 
 def lookup_dict(word):
-    return data.noun_dict.get(word, [])
-
-
-def verify_affix(word, list_seg, affix_list):
-    """
-    Verify possible affixes in the resulted segments according
-    to the given affixes list.
-    @param word: the input word.
-    @type word: unicode.
-    @param list_seg: list of word segments indexes (numbers).
-    @type list_seg: list of pairs.
-    @return: list of acceped segments.
-    @rtype: list of pairs.
-    """
-    return [s for s in list_seg if "-".join([word[: s[0]], word[s[1] :]]) in affix_list]
+    return data.noun_dict.get(word, ())
 
 
 def stem_variants(stem, enclitic_nm):
@@ -247,7 +233,7 @@ def check_clitic_affix(noun_tuple, proclitic, enclitic, suffix):
     return is_valid_affix(proclitic_tags, enclitic_tags, suffix_tags)
 
 
-@cache
+@cached("vocalize", vocalize_cache_size)
 def vocalize(noun, proclitic, suffix, enclitic):
     """
     Vocalizes a noun.
@@ -255,170 +241,105 @@ def vocalize(noun, proclitic, suffix, enclitic):
     return generator.vocalize(noun, proclitic, suffix, enclitic)
 
 
+def noun_candidates(noun: str) -> Iterator[tuple[str, str, str, str, list]]:
+    """
+    Segments a noun into (proclitic, enclitic, suffix, stem, dictionary entries)
+
+    Only stems with entries in the dictionary are yielded
+    """
+    for start, end in verify_affix(
+        noun, comp_stemmer.segment(noun), SNC.COMP_NOUN_AFFIXES
+    ):
+        proclitic = noun[:start]
+        enclitic = noun[end:]
+        stem_comp = noun[start:end]
+        for candidate in (stem_comp, *stem_variants(stem_comp, enclitic)):
+            for _, conj_end in verify_affix(
+                candidate,
+                conj_stemmer.segment(candidate),
+                SNC.NOMINAL_CONJUGATION_AFFIX,
+            ):
+                suffix = candidate[conj_end:]
+                stem_conj = araby.normalize_hamza(candidate[:conj_end])
+                for stem in get_stem_variants(stem_conj, suffix):
+                    if noun_tuples := lookup_dict(stem):
+                        yield proclitic, enclitic, suffix, stem, noun_tuples
+
+
 def stem_noun(noun: str) -> list[WordCase]:
     detailed_result = []
     noun_list = [*{noun, *noun_variants(noun)}]
+    # the results have always been named after the last variant
+    word = noun_list[-1]
 
-    word_segmented_list = []
     for noun in noun_list:
-        list_seg_comp = comp_stemmer.segment(noun)
-        # filter
-        list_seg_comp = verify_affix(noun, list_seg_comp, SNC.COMP_NOUN_AFFIXES)
-        # treat multi vocalization enclitic
-        for seg in list_seg_comp:
-            proclitic_nm = noun[: seg[0]]
-            stem = noun[seg[0] : seg[1]]
-            enclitic_nm = noun[seg[1] :]
-            # ajusting nouns variant
-            list_stem = [
-                stem,
-            ] + stem_variants(stem, enclitic_nm)
-
-            # stem reduced noun : level two
-            for stem in list_stem:
-                word_seg = {
-                    "noun": noun,
-                    "stem_comp": stem,
-                    "pro": proclitic_nm,
-                    "enc": enclitic_nm,
-                }
-                word_segmented_list.append(word_seg)
-
-    # level two
-    tmp_list = []
-
-    for word_seg in word_segmented_list:
-        list_seg_conj = conj_stemmer.segment(word_seg["stem_comp"])
-        list_seg_conj = verify_affix(
-            word_seg["stem_comp"], list_seg_conj, SNC.NOMINAL_CONJUGATION_AFFIX
-        )
-        for seg_conj in list_seg_conj:
-            stem_conj = word_seg["stem_comp"][: seg_conj[1]]
-            suffix = word_seg["stem_comp"][seg_conj[1] :]
-            stem_conj = araby.normalize_hamza(stem_conj)
-            stem_conj_list = get_stem_variants(stem_conj, suffix)
-
-            for stem in stem_conj_list:
-                word_seg_l2 = word_seg.copy()
-                # normalize hamza before gessing  differents origines
-                word_seg_l2["stem_conj"] = stem
-                word_seg_l2["suffix"] = suffix
-                # affixes tags contains prefixes and suffixes tags
-                word_seg_l2["affix_tags"] = list(
-                    set(
-                        SNC.COMP_PREFIX_LIST_TAGS[word_seg_l2["pro"]]["tags"]
-                        + SNC.COMP_SUFFIX_LIST_TAGS[word_seg_l2["enc"]]["tags"]
-                        + SNC.CONJ_SUFFIX_LIST_TAGS[word_seg_l2["suffix"]]["tags"]
-                    )
+        for proclitic, enclitic, suffix, stem, noun_tuples in noun_candidates(noun):
+            proclitic_tags = SNC.COMP_PREFIX_LIST_TAGS[proclitic]
+            enclitic_tags = SNC.COMP_SUFFIX_LIST_TAGS[enclitic]
+            # validate_tags only checks for tags
+            affix_tags = (
+                proclitic_tags["tags"]
+                + enclitic_tags["tags"]
+                + SNC.CONJ_SUFFIX_LIST_TAGS[suffix]["tags"]
+            )
+            # all vocalized forms of the affixes
+            vocalized_affixes = [
+                *product(
+                    proclitic_tags["vocalized"],
+                    enclitic_tags["vocalized"],
+                    SNC.CONJ_SUFFIX_LIST_TAGS[suffix]["vocalized"],
                 )
-                tmp_list.append(word_seg_l2)
-
-    word_segmented_list = tmp_list
-    tmp_list = []
-    for word_seg in word_segmented_list:
-        inf_noun = word_seg["stem_conj"]
-        infnoun_foundlist = lookup_dict(inf_noun)
-
-        for noun_tuple in infnoun_foundlist:
-            word_seg_l3 = word_seg.copy()
-            word_seg_l3["original"] = noun_tuple["vocalized"]
-            word_seg_l3["noun_tuple"] = dict(noun_tuple)
-            tmp_list.append(word_seg_l3)
-
-    # test compatiblity noun_tuple with affixes and proaffixes
-    # and generate vocalized affixes and suffixes
-
-    word_segmented_list = tmp_list
-    tmp_list = []
-    for word_seg in word_segmented_list:
-        # test if the given word from dictionary accept those
-        # tags given by affixes
-        if validate_tags(
-            word_seg["noun_tuple"],
-            word_seg["affix_tags"],
-            word_seg["pro"],
-            word_seg["enc"],
-            word_seg["suffix"],
-        ):
-            ## get all vocalized form of suffixes
-            for pro_voc in SNC.COMP_PREFIX_LIST_TAGS[word_seg["pro"]]["vocalized"]:
-                for enc_voc in SNC.COMP_SUFFIX_LIST_TAGS[word_seg["enc"]]["vocalized"]:
-                    for suf_voc in SNC.CONJ_SUFFIX_LIST_TAGS[word_seg["suffix"]][
-                        "vocalized"
-                    ]:
-                        ## verify compatibility between proclitics and affix
-                        if check_clitic_affix(
-                            word_seg["noun_tuple"], pro_voc, enc_voc, suf_voc
-                        ):
-                            # get affix tags
-                            affix_tags_voc = (
-                                SNC.COMP_PREFIX_LIST_TAGS[pro_voc]["tags"]
-                                + SNC.COMP_SUFFIX_LIST_TAGS[enc_voc]["tags"]
-                                + SNC.CONJ_SUFFIX_LIST_TAGS[suf_voc]["tags"]
-                            )
-                            word_seg_l4 = word_seg.copy()
-                            word_seg_l4["suf_voc"] = suf_voc
-                            word_seg_l4["enc_voc"] = enc_voc
-                            word_seg_l4["affix_tags"] = affix_tags_voc
-                            tmp_list.append(word_seg_l4)
-
-    word_segmented_list = tmp_list
-    tmp_list = []
-    for word_seg in word_segmented_list:
-        # get voalized and vocalized without inflection
-        # ~ vocalized, semi_vocalized, _ = self.vocalize(
-        voca_tuple_list = vocalize(
-            word_seg["noun_tuple"]["vocalized"],
-            word_seg["pro"],
-            word_seg["suf_voc"],
-            word_seg["enc_voc"],
-        )
-        for vocalized, semi_vocalized, _ in voca_tuple_list:
-            # add some tags from dictionary entry as
-            # mamnou3 min sarf and broken plural
-            original_tags = []
-            if word_seg["noun_tuple"]["mankous"] == "Tk":
-                original_tags.append("منقوص")
-            # if there are many cases like feminin plural with mansoub and majrour
-            if "cases" in SNC.CONJ_SUFFIX_LIST_TAGS[word_seg["suf_voc"]]:
-                list_cases = SNC.CONJ_SUFFIX_LIST_TAGS[word_seg["suf_voc"]]["cases"]
-            else:
-                list_cases = ("",)
-            for case in list_cases:
-                voc_affix_case = word_seg["affix_tags"] + (case,)
-                # filter empty
-                voc_affix_case = [vac for vac in voc_affix_case if vac]
-                detailed_result.append(
-                    WordCase(
-                        {
-                            "word": noun,
-                            "affix": (
-                                word_seg["pro"],
-                                "",
-                                word_seg["suf_voc"],
-                                word_seg["enc_voc"],
-                            ),
-                            "stem": word_seg["stem_conj"],
-                            "root": araby.normalize_hamza(
-                                word_seg["noun_tuple"].get("root", "")
-                            ),
-                            "original": word_seg["noun_tuple"][
-                                "vocalized"
-                            ],  # original,
-                            "vocalized": vocalized,
-                            "semivocalized": semi_vocalized,
-                            "tags": ":".join(voc_affix_case),
-                            "type": ":".join(
-                                ["Noun", word_seg["noun_tuple"]["wordtype"]]
-                            ),
-                            "number": word_seg["noun_tuple"]["number"],
-                            "gender": word_seg["noun_tuple"]["gender"],
-                            "freq": "freqnoun",  # to note the frequency type
-                            "originaltags": ":".join(original_tags),
-                            "syntax": "",
-                        }
+            ]
+            for noun_tuple in noun_tuples:
+                # test if the given word from dictionary accept those
+                # tags given by affixes
+                if not validate_tags(
+                    noun_tuple, affix_tags, proclitic, enclitic, suffix
+                ):
+                    continue
+                root = araby.normalize_hamza(noun_tuple.get("root", ""))
+                word_type = "Noun:" + noun_tuple["wordtype"]
+                original_tags = "منقوص" if noun_tuple["mankous"] == "Tk" else ""
+                for pro_voc, enc_voc, suf_voc in vocalized_affixes:
+                    ## verify compatibility between proclitics and affix
+                    if not check_clitic_affix(noun_tuple, pro_voc, enc_voc, suf_voc):
+                        continue
+                    suffix_tags = SNC.CONJ_SUFFIX_LIST_TAGS[suf_voc]
+                    affix_tags_voc = (
+                        SNC.COMP_PREFIX_LIST_TAGS[pro_voc]["tags"]
+                        + SNC.COMP_SUFFIX_LIST_TAGS[enc_voc]["tags"]
+                        + suffix_tags["tags"]
                     )
-                )
+                    # if there are many cases like feminin plural
+                    # with mansoub and majrour
+                    list_cases = suffix_tags.get("cases", ("",))
+                    for vocalized, semi_vocalized, _ in vocalize(
+                        noun_tuple["vocalized"], proclitic, suf_voc, enc_voc
+                    ):
+                        for case in list_cases:
+                            tags = ":".join(
+                                tag for tag in (*affix_tags_voc, case) if tag
+                            )
+                            detailed_result.append(
+                                WordCase(
+                                    {
+                                        "word": word,
+                                        "affix": (proclitic, "", suf_voc, enc_voc),
+                                        "stem": stem,
+                                        "root": root,
+                                        "original": noun_tuple["vocalized"],
+                                        "vocalized": vocalized,
+                                        "semivocalized": semi_vocalized,
+                                        "tags": tags,
+                                        "type": word_type,
+                                        "number": noun_tuple["number"],
+                                        "gender": noun_tuple["gender"],
+                                        "freq": "freqnoun",  # to note the frequency type
+                                        "originaltags": original_tags,
+                                        "syntax": "",
+                                    }
+                                )
+                            )
     return detailed_result
 
 
@@ -0,0 +1,307 @@
+"""
+Caches for the state the server keeps between requests
+
+Named caches are registered, so that they can be inspected (`stats()`),
+emptied (`clear()`) and share one memory budget (`memory_budget`)
+"""
+
+import json
+import os
+import sqlite3
+import sys
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock, local
+from typing import Any, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+memory_budget = 256 * 2**20
+"""How many bytes (estimated) the caches with a `sizeof` may hold together"""
+
+registry: dict[str, "LRUCache | SQLiteCache"] = {}
+_budget_lock = Lock()
+
+
+def _sizeof(obj: Any, depth: int = 3) -> int:
+    size = sys.getsizeof(obj)
+    if not depth or obj.__class__ is str:
+        return size
+    if isinstance(obj, (tuple, list, set, frozenset)):
+        for item in obj:
+            # most items are strings
+            if item.__class__ is str:
+                size += sys.getsizeof(item)
+            else:
+                size += _sizeof(item, depth - 1)
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _sizeof(key, depth - 1) + _sizeof(value, depth - 1)
+    return size
+
+
+def estimate_size(key: Any, value: Any) -> int:
+    """
+    A rough estimate of the bytes an entry holds,
+    good enough for strings, numbers and small containers of them
+    """
+    return _sizeof(key) + _sizeof(value)
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A thread-safe mapping that forgets the least recently used items
+    once it holds more than `maxsize` (None is unbounded)
+
+    With a `name` the cache is registered, with a `sizeof` it also counts
+    towards the `memory_budget`
+    """
+
+    def __init__(
+        self,
+        maxsize: int | None,
+        name: str | None = None,
+        sizeof: Callable[[K, V], int] | None = None,
+    ):
+        self.maxsize = maxsize
+        self.name = name
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._items: OrderedDict[K, V] = OrderedDict()
+        self._sizes: dict[K, int] = {}
+        self._lock = Lock()
+        if name is not None:
+            registry[name] = self
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: K, value: V) -> V:
+        with self._lock:
+            self._add(key, value)
+            self._evict()
+        self._enforce_budget()
+        return value
+
+    def setdefault(self, key: K, value: V) -> V:
+        with self._lock:
+            if key in self._items:
+                value = self._items[key]
+                self._items.move_to_end(key)
+            else:
+                self._add(key, value)
+                self._evict()
+        self._enforce_budget()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict[str, int | None]:
+        return {
+            "items": len(self._items),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes if self.sizeof else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _add(self, key: K, value: V):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if self.sizeof:
+            size = self.sizeof(key, value)
+            self.bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+
+    def _pop_oldest(self):
+        key, _ = self._items.popitem(last=False)
+        self.bytes -= self._sizes.pop(key, 0)
+        self.evictions += 1
+
+    def _evict(self):
+        if self.maxsize is None:
+            return
+        while len(self._items) > self.maxsize:
+            self._pop_oldest()
+
+    def _enforce_budget(self):
+        if not self.sizeof or not self.bytes:
+            return
+        # only one thread has to do the work
+        if not _budget_lock.acquire(blocking=False):
+            return
+        try:
+            sized = [
+                cache
+                for cache in registry.values()
+                if isinstance(cache, LRUCache) and cache.sizeof
+            ]
+            total = sum(cache.bytes for cache in sized)
+            while total > memory_budget:
+                # the biggest cache gives up its least recently used item
+                biggest = max(sized, key=lambda cache: cache.bytes)
+                with biggest._lock:
+                    if not biggest._items:
+                        break
+                    before = biggest.bytes
+                    biggest._pop_oldest()
+                    total -= before - biggest.bytes
+        finally:
+            _budget_lock.release()
+
+
+class SQLiteCache:
+    """
+    A persistent cache in a SQLite file that all worker processes
+    read and fill at the same time and that survives restarts
+
+    Entries are only valid for one `version` (for example a hash of the data
+    they were computed from). Keys and values are stored as JSON,
+    so values have to be tuples (or lists) of JSON values and come back as tuples
+    """
+
+    def __init__(self, path: str, version: str, name: str | None = None):
+        self.path = path
+        self.version = version
+        self.name = name
+        self.hits = self.misses = 0
+        self._local = local()
+        # entries of other versions would never be read again
+        connection = self._connection()
+        connection.execute("DELETE FROM entries WHERE version != ?", (version,))
+        connection.commit()
+        if name is not None:
+            registry[name] = self
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections can't be shared between threads or forked processes
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(version TEXT, key TEXT, value TEXT, PRIMARY KEY (version, key))"
+            )
+            connection.commit()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key: Hashable) -> tuple | None:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value FROM entries WHERE version = ? AND key = ?",
+                (self.version, json.dumps(key, ensure_ascii=False)),
+            )
+            .fetchone()
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tuple(json.loads(row[0]))
+
+    def put(self, key: Hashable, value: tuple) -> tuple:
+        connection = self._connection()
+        # another process may have been faster, their result is the same
+        connection.execute(
+            "INSERT OR IGNORE INTO entries VALUES (?, ?, ?)",
+            (
+                self.version,
+                json.dumps(key, ensure_ascii=False),
+                json.dumps(value, ensure_ascii=False),
+            ),
+        )
+        connection.commit()
+        return value
+
+    def __len__(self) -> int:
+        return (
+            self._connection()
+            .execute("SELECT COUNT(*) FROM entries WHERE version = ?", (self.version,))
+            .fetchone()[0]
+        )
+
+    def clear(self):
+        """Deletes the entries of this version"""
+        connection = self._connection()
+        connection.execute("DELETE FROM entries WHERE version = ?", (self.version,))
+        connection.commit()
+
+    def stats(self) -> dict[str, int | None]:
+        return {
+            "items": len(self),
+            "maxsize": None,
+            "bytes": os.path.getsize(self.path),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": 0,
+        }
+
+
+_missing = object()
+
+
+def cached(
+    name: str,
+    maxsize: int | None = None,
+    sizeof: Callable[[Any, Any], int] | None = estimate_size,
+):
+    """
+    Like `functools.lru_cache` for functions with positional arguments,
+    but the cache is registered under `name` (see `registry`)
+    """
+
+    def decorator(function: Callable) -> Callable:
+        cache: LRUCache = LRUCache(maxsize, name, sizeof)
+
+        @wraps(function)
+        def wrapper(*args):
+            value = cache.get(args, _missing)
+            if value is _missing:
+                value = cache.put(args, function(*args))
+            return value
+
+        wrapper.cache = cache  # type: ignore
+        return wrapper
+
+    return decorator
+
+
+def stats() -> dict[str, dict[str, int | None]]:
+    """
+    The statistics of all registered caches
+    """
+    return {name: cache.stats() for name, cache in registry.items()}
+
+
+def clear(persistent: bool = False):
+    """
+    Empties all registered caches
+
+    The persistent caches are shared with the other processes
+    and only emptied if `persistent` is true
+    """
+    for cache in registry.values():
+        if persistent or not isinstance(cache, SQLiteCache):
+            cache.clear()
@@ -3,14 +3,19 @@ The data module encapsulates all static data to represent a single source of tru
 for all other modules
 """
 
+import hashlib
 import json
 import re
 from collections import defaultdict
 from contextlib import contextmanager
+from functools import cache, partial
+from threading import RLock
+from typing import Any, Callable
 
 from pyarabic import araby
 
-from data_types import Case
+import lexicons
+from data_types import Case, LexiconRow, NounRow, VerbRow
 
 
 def read(path):
@@ -32,59 +37,199 @@ def readWrite(path):
         write(path, data)
 
 
-known_names: set[str] = {
-    *read("data/ner.json"),
-    "محمد",
-    "القاهرة",
-    # ibrahim 2x
-    "إبرهيم",
-    "إبراهيم",
-    # yasin
-    "ياسين",
-    # 3amr
-    "عمرو",
-}
-
-
-freq_dict = {}
-unknown_dict = {}
+# The lexicons are only loaded on first use (see `__getattr__`),
+# so that pages which don't analyze Arabic never parse them
 
-for entry in read("data/wordfreq.json"):
-    freq_dict[(entry["vocalized"], entry["word_type"])] = entry["freq"]
-    freq_dict[(entry["unvocalized"], entry["word_type"])] = entry["freq"]
-    unknown_dict[entry["unvocalized"]] = entry
-
-noun_dict: dict[str, list] = defaultdict(list)
-
-for entry in read("./data/nouns.json"):
-    noun_dict[entry["normalized"]].append(entry)
+known_names: set[str]
+freq_dict: dict[tuple[str, str], int]
+unknown_dict: dict[str, dict]
+noun_dict: dict[str, tuple[NounRow, ...]]
+verb_dict: dict[str, tuple[VerbRow, ...]]
+short_verb_stamps: frozenset[str]
+"""
+The verb stamps a candidate stem can have, a stamp without TEH
+that isn't one of these can't be a verb (see VerbStemmer.exists_as_stamp)
+"""
+stopword_dict: dict[str, list]
+sem_derivations: dict[str, tuple[str, str]]
+sem_relations: dict[tuple[str, str], str]
+
+_loaders: dict[str, Callable[[str], dict[str, Any]]] = {}
+_load_lock = RLock()
+lexicon_sources: dict[str, list[str]] = {}
+"""The files every lexicon is built from"""
+lexicon_backend: Callable[[str], Any] | None = None
+"""
+Serves lexicons by name instead of the JSON files and returns None
+for those it doesn't have (see `use_mapped_lexicons` and `use_sqlite_lexicons`)
+"""
 
-verb_dict: dict[str, list] = defaultdict(list)
 
-for entry in read("./data/verbs.json"):
-    verb_dict[entry["stamped"]].append(entry)
+def lexicon(*names: str, source: str):
+    """
+    Registers the function that loads the lexicons with the given names
+    from the source file
+    """
+
+    def decorator(load: Callable[[str], dict[str, Any]]):
+        for name in names:
+            _loaders[name] = load
+            lexicon_sources[name] = [source]
+        return load
+
+    return decorator
+
+
+def __getattr__(name: str) -> Any:
+    load = _loaders.get(name)
+    if load is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _load_lock:
+        # another thread may have loaded it while we waited
+        if name not in globals():
+            # afterwards the lexicons are plain globals and this isn't called again
+            if lexicon_backend and (served := lexicon_backend(name)) is not None:
+                globals()[name] = served
+            else:
+                # the backend may already serve the others of the same file
+                for loaded, value in load(lexicon_sources[name][0]).items():
+                    globals().setdefault(loaded, value)
+    return globals()[name]
+
+
+def use_mapped_lexicons(directory: str):
+    """
+    Serves the lexicons from the mapped lexicons in the directory
+    (see tools/build_lexicons.py) instead of parsing the JSON files.
+    Only affects lexicons that aren't loaded yet
+    """
+    global lexicon_backend
+    lexicon_backend = partial(lexicons.open_mapped, directory)
+
+
+def use_sqlite_lexicons(directory: str | None = None):
+    """
+    Serves the lexicons that have a table in the SQLite databases of arramooz
+    (see lexicons.sqlite_tables) from these databases instead of loading them.
+    Only affects lexicons that aren't loaded yet
+    """
+    global lexicon_backend
+    directory = directory or lexicons.arramooz_data()
+    lexicon_backend = partial(lexicons.open_sqlite, directory)
+
+
+def loaded_lexicons() -> set[str]:
+    """
+    The names of the lexicons that are already loaded
+    """
+    return _loaders.keys() & globals().keys()
+
+
+@lexicon("known_names", source="data/ner.json")
+def _load_known_names(path: str):
+    known_names = {
+        *read(path),
+        "محمد",
+        "القاهرة",
+        # ibrahim 2x
+        "إبرهيم",
+        "إبراهيم",
+        # yasin
+        "ياسين",
+        # 3amr
+        "عمرو",
+    }
+    return {"known_names": known_names}
+
+
+@lexicon("freq_dict", "unknown_dict", source="data/wordfreq.json")
+def _load_word_frequencies(path: str):
+    freq_dict = {}
+    unknown_dict = {}
+    for entry in read(path):
+        freq_dict[(entry["vocalized"], entry["word_type"])] = entry["freq"]
+        freq_dict[(entry["unvocalized"], entry["word_type"])] = entry["freq"]
+        unknown_dict[entry["unvocalized"]] = entry
+    return {"freq_dict": freq_dict, "unknown_dict": unknown_dict}
+
+
+def read_lexicon(path: str, key: str, row_type: type[LexiconRow]) -> dict[str, tuple]:
+    """
+    Reads a lexicon into compact rows grouped by the `key` field
+    """
+    intern: dict[str, str] = {}
+    lexicon: dict[str, list] = defaultdict(list)
+    for entry in read(path):
+        key_value = intern.setdefault(entry[key], entry[key])
+        lexicon[key_value].append(row_type.from_entry(entry, intern))
+    return {key: tuple(rows) for key, rows in lexicon.items()}
+
+
+@lexicon("noun_dict", source="data/nouns.json")
+def _load_nouns(path: str):
+    return {"noun_dict": read_lexicon(path, "normalized", NounRow)}
+
+
+@lexicon("verb_dict", "short_verb_stamps", source="data/verbs.json")
+def _load_verbs(path: str):
+    verb_dict = read_lexicon(path, "stamped", VerbRow)
+    return {
+        "verb_dict": verb_dict,
+        "short_verb_stamps": frozenset(s for s in verb_dict if len(s) <= 4),
+    }
 
-# stopword_dict: dict[str, list] = defaultdict(list)
 
 # for entry in read("./data/stopwords.json"):
 #     stopword_dict[(entry["vocalized"], entry["word_type"])] = entry
 #     stopword_dict[(entry["unvocalized"], entry["word_type"])] = entry
 
-stopword_dict: dict[str, list] = defaultdict(list)
 
-for entry in read("./data/cstopwords.json"):
-    stopword_dict[entry["WORD"]].append(entry)
+@lexicon("stopword_dict", source="data/cstopwords.json")
+def _load_stopwords(path: str):
+    stopword_dict: dict[str, list] = defaultdict(list)
+    for entry in read(path):
+        stopword_dict[entry["WORD"]].append(entry)
+    return {"stopword_dict": stopword_dict}
 
-sem_derivations: dict[str, tuple[str, str]] = {}
 
-for entry in read("./data/semantic_derivations.json"):
-    sem_derivations.setdefault(entry["derived"], (entry["verb"], entry["type"]))
+@lexicon("sem_derivations", source="data/semantic_derivations.json")
+def _load_semantic_derivations(path: str):
+    sem_derivations: dict[str, tuple[str, str]] = {}
+    for entry in read(path):
+        sem_derivations.setdefault(entry["derived"], (entry["verb"], entry["type"]))
+    return {"sem_derivations": sem_derivations}
 
 
-sem_relations: dict[tuple[str, str], str] = {}
+@lexicon("sem_relations", source="data/semantic_relations.json")
+def _load_semantic_relations(path: str):
+    sem_relations: dict[tuple[str, str], str] = {}
+    for entry in read(path):
+        sem_relations.setdefault((entry["first"], entry["second"]), entry["rule"])
+    return {"sem_relations": sem_relations}
 
-for entry in read("./data/semantic_relations.json"):
-    sem_relations.setdefault((entry["first"], entry["second"]), entry["rule"])
+
+lexicon_files = [
+    "data/ner.json",
+    "data/wordfreq.json",
+    "data/nouns.json",
+    "data/verbs.json",
+    "data/cstopwords.json",
+    "data/semantic_derivations.json",
+    "data/semantic_relations.json",
+]
+"""The files the analysis of a word depends on"""
+
+
+@cache
+def lexicon_version() -> str:
+    """
+    A hash of the lexicon files, changes whenever the lexicon changes
+    """
+    version = hashlib.sha1()
+    for path in lexicon_files:
+        with open(path, "rb") as f:
+            version.update(hashlib.file_digest(f, "sha1").digest())
+    return version.hexdigest()
 
 
 def compile_single_char_map_pattern(d: dict[str, str]) -> re.Pattern:
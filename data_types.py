@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Literal
+from dataclasses import dataclass, field
+from typing import ClassVar, Literal
 
 Pos = Literal["stopword", "noun", "verb", ""]
 
@@ -87,17 +87,22 @@ class Profile:
     # TODO: alif maqsura mit Unterpunkt
 
 
-@dataclass
+@dataclass(slots=True)
 class Token:
-    def __post_init__(self):
-        import data
+    """
+    A token of a cleaned text
 
-        self.latin_after = data.sub_after(self.after)
-        self.original = self.arab
+    The token refers to the text by its offset instead of holding copies of its
+    parts. `arab` is only copied once it changes and the text after the token
+    is only transliterated when it is needed
+    """
 
-    arab: str
-    after: str = ""
-    original: str = ""
+    text: str = field(repr=False)
+    """The whole cleaned text, shared by all its tokens"""
+    start: int
+    length: int
+    after_length: int
+    """The length of the text after the token up to the next token"""
     lemma: str = ""
     pos: Pos = ""
     gram_case: Case = ""
@@ -111,8 +116,62 @@ class Token:
     is_nisba: bool = False
 
     latin: str = ""
-    latin_after: str = ""
     latin_prefix: str = ""
+    _arab: str | None = field(default=None, init=False)
+    _latin_after: str | None = field(default=None, init=False, repr=False)
+
+    @property
+    def end(self) -> int:
+        return self.start + self.length
+
+    @property
+    def original(self) -> str:
+        return self.text[self.start : self.end]
+
+    @property
+    def arab(self) -> str:
+        """The token, as it is changed by the analysis"""
+        if self._arab is None:
+            return self.original
+        return self._arab
+
+    @arab.setter
+    def arab(self, arab: str):
+        self._arab = arab
+
+    @property
+    def after(self) -> str:
+        return self.text[self.end : self.end + self.after_length]
+
+    @property
+    def latin_after(self) -> str:
+        if self._latin_after is None:
+            import data
+
+            self._latin_after = data.sub_after(self.after)
+        return self._latin_after
+
+    @latin_after.setter
+    def latin_after(self, latin_after: str):
+        self._latin_after = latin_after
+
+    def to_dict(self) -> dict:
+        """
+        The fields without the text
+        """
+        token = {name: getattr(self, name) for name in self.__dataclass_fields__}
+        del token["text"], token["_arab"], token["_latin_after"]
+        token["arab"] = self.arab
+        token["latin_after"] = self.latin_after
+        return token
+
+    @classmethod
+    def from_dict(cls, text: str, token: dict) -> "Token":
+        fields = token.copy()
+        arab, latin_after = fields.pop("arab"), fields.pop("latin_after")
+        token = cls(text, **fields)
+        token.arab, token.latin_after = arab, latin_after
+        return token
 
     @property
     def is_genetive(self) -> bool:
@@ -120,18 +179,50 @@ class Token:
 
     @property
     def result(self) -> str:
-        latin = self.latin
+        return self.render(self.latin_prefix, self.latin)
+
+    def render(self, latin_prefix: str, latin: str) -> str:
+        """
+        The result with the given rendering of the token
+        """
         if self.is_name:
             if len(latin) >= 2 and latin[0] in "ʿʾ" and latin[1] in "aui":
                 latin = latin[0] + latin[1:].capitalize()
             else:
-                latin = self.latin.capitalize()
-        return self.latin_prefix + latin + self.latin_after
+                latin = latin.capitalize()
+        return latin_prefix + latin + self.latin_after
 
 
 Sentence = list[Token]
 
 
+@dataclass
+class Analysis:
+    """
+    Everything `trans.analyze` found out about a text
+
+    Only the rendering is left, which is done for each profile by `trans.render`
+    """
+
+    beginning: str
+    """The (already transliterated) text before the first token"""
+    tokens: list[Token] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "beginning": self.beginning,
+            "text": self.tokens[0].text if self.tokens else "",
+            "tokens": [token.to_dict() for token in self.tokens],
+        }
+
+    @classmethod
+    def from_dict(cls, analysis: dict) -> "Analysis":
+        tokens = [
+            Token.from_dict(analysis["text"], token) for token in analysis["tokens"]
+        ]
+        return cls(analysis["beginning"], tokens)
+
+
 @dataclass
 class NameProfile:
     is_book: bool = False
@@ -148,3 +239,87 @@ class NameProfile:
 class IJMESProfile:
     is_name: bool = False
     diphthongs: bool = False
+
+
+class LexiconRow(tuple):
+    """
+    A compact, read-only lexicon entry that can be read like the dict it came from
+
+    Only the `columns` the stemmers need are kept and the boolean `flags`
+    are packed into the last item
+
+    Only the dict side is meant for reading: `row[key]` and `row.get(key)` take
+    names and raise a TypeError for anything else, like an index.
+    The tuple side (iteration, `in`, `len`) sees the stored values
+    and is what the lexicon files are written from
+    """
+
+    __slots__ = ()
+    columns: ClassVar[dict[str, int]] = {}
+    flags: ClassVar[dict[str, int]] = {}
+
+    @classmethod
+    def from_entry(cls, entry: dict, intern: dict) -> "LexiconRow":
+        """
+        `intern` is shared between the rows, so equal strings are only stored once
+        """
+        values = [
+            intern.setdefault(value, value) if isinstance(value, str) else value
+            for value in map(entry.get, cls.columns)
+        ]
+        packed = 0
+        for flag, bit in cls.flags.items():
+            if entry.get(flag):
+                packed |= bit
+        return cls((*values, packed))
+
+    def __getitem__(self, key):  # type: ignore
+        if not isinstance(key, str):
+            raise TypeError(f"{type(self).__name__} is read by name, not by {key!r}")
+        if (index := self.columns.get(key)) is not None:
+            return tuple.__getitem__(self, index)
+        if (bit := self.flags.get(key)) is not None:
+            return bool(tuple.__getitem__(self, -1) & bit)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> list[str]:
+        return [*self.columns, *self.flags]
+
+    def __repr__(self) -> str:
+        fields = {key: self[key] for key in self.keys()}
+        return f"{type(self).__name__}({fields})"
+
+
+def _columns(*names: str) -> dict[str, int]:
+    return {name: i for i, name in enumerate(names)}
+
+
+def _flags(*names: str) -> dict[str, int]:
+    return {name: 1 << i for i, name in enumerate(names)}
+
+
+class NounRow(LexiconRow):
+    __slots__ = ()
+    columns = _columns(
+        "vocalized", "unvocalized", "wordtype", "root", "number", "gender", "mankous"
+    )
+    flags = _flags(
+        "mamnou3_sarf",
+        "masculin_plural",
+        "w_suffix",
+        "hm_suffix",
+        "ha_suffix",
+        "k_prefix",
+        "kal_prefix",
+    )
+
+
+class VerbRow(LexiconRow):
+    __slots__ = ()
+    columns = _columns("vocalized", "transitive", "future_type", "stamped", "root")
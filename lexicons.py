@@ -0,0 +1,392 @@
+"""
+Lexicon backends that answer lookups without loading a lexicon into a dict
+(see data.use_mapped_lexicons and data.use_sqlite_lexicons)
+
+A mapped lexicon is a binary file (built by tools/build_lexicons.py) that is
+read through `mmap`, so all worker processes share one copy in the page cache
+and opening it is almost free. The layout is
+
+    magic (6 bytes) | format version (u16) | header length (u32) | header
+    key offsets     (count + 1) × u32, relative to the keys
+    value offsets   (count + 1) × u32, relative to the values
+    keys            UTF-8, sorted bytewise
+    values          one JSON document per key
+
+The header is JSON and says how the values are decoded, which source
+files (by hash) the lexicon was built from and the columns of its rows
+
+A SQLite lexicon reads the upstream databases of arramooz, which the JSON
+files in data were exported from (see tools/sqlite2json.py). It holds almost
+nothing in memory, but every lookup that misses its small cache is a query
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import warnings
+from array import array
+from collections.abc import Mapping
+from functools import cache
+from pathlib import Path
+from threading import local
+from typing import Any, Callable, Iterator, NamedTuple
+
+import data_types
+from caches import LRUCache, estimate_size
+
+sqlite_cache_size = 2**12
+"""How many lookups every SQLite lexicon remembers"""
+
+magic = b"DMGLEX"
+format_version = 1
+_prefix = struct.Struct("<6sHI")
+
+# tuple keys (like freq_dict's (word, word_type)) are joined with this
+key_separator = "\x1f"
+
+
+def encode_key(key: str | tuple[str, ...]) -> bytes:
+    if isinstance(key, tuple):
+        key = key_separator.join(key)
+    return key.encode()
+
+
+@cache
+def source_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest()
+
+
+def row_schema(value_type: str) -> dict | None:
+    """
+    The columns and flags of the rows of a lexicon (see data_types.LexiconRow),
+    None for other values
+    """
+    row_type = getattr(data_types, value_type, None)
+    if not (isinstance(row_type, type) and issubclass(row_type, data_types.LexiconRow)):
+        return None
+    return {"columns": [*row_type.columns], "flags": [*row_type.flags]}
+
+
+def _value_type(lexicon: Mapping | set | frozenset) -> str:
+    if isinstance(lexicon, (set, frozenset)):
+        return "set"
+    value = next(iter(lexicon.values()), None)
+    if isinstance(value, tuple) and value and isinstance(value[0], tuple):
+        # the rows of data_types.LexiconRow subclasses
+        return type(value[0]).__name__
+    if isinstance(value, tuple):
+        return "tuple"
+    return "json"
+
+
+def write_mapped(
+    path: str, lexicon: Mapping | set | frozenset, sources: list[str]
+) -> int:
+    """
+    Writes a dict (or set) of a lexicon as a mapped lexicon,
+    returns the number of keys
+    """
+    value_type = _value_type(lexicon)
+    items = sorted(
+        (encode_key(key), None if value_type == "set" else lexicon[key])  # type: ignore
+        for key in lexicon
+    )
+    key_offsets, value_offsets = array("I", [0]), array("I", [0])
+    keys, values = bytearray(), bytearray()
+    for key, value in items:
+        keys += key
+        key_offsets.append(len(keys))
+        if value_type != "set":
+            values += json.dumps(
+                value, ensure_ascii=False, separators=(",", ":")
+            ).encode()
+        value_offsets.append(len(values))
+    header = json.dumps(
+        {
+            "count": len(items),
+            "values": value_type,
+            "tuple_keys": isinstance(next(iter(lexicon), None), tuple),
+            "byteorder": sys.byteorder,
+            "sources": {source: source_digest(source) for source in sources},
+            "schema": row_schema(value_type),
+        }
+    ).encode()
+    # the offset tables stay aligned
+    header += b" " * (-(_prefix.size + len(header)) % 4)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_prefix.pack(magic, format_version, len(header)))
+        f.write(header)
+        f.write(key_offsets.tobytes())
+        f.write(value_offsets.tobytes())
+        f.write(keys)
+        f.write(values)
+    os.replace(tmp_path, path)
+    return len(items)
+
+
+class MappedLexicon(Mapping):
+    """
+    A read-only mapping on a mapped lexicon, keys are found by binary search
+    and only the values that are looked up are decoded
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, version, header_size = _prefix.unpack_from(self._map)
+        if file_magic != magic or version != format_version:
+            raise ValueError(
+                f"{path} is not a mapped lexicon (version {format_version})"
+            )
+        start = _prefix.size
+        self.header = json.loads(self._map[start : start + header_size])
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built on a machine with another byte order")
+        self.count: int = self.header["count"]
+        start += header_size
+        view = memoryview(self._map)
+        table_size = 4 * (self.count + 1)
+        self._key_offsets = view[start : start + table_size].cast("I")
+        start += table_size
+        self._value_offsets = view[start : start + table_size].cast("I")
+        self._keys = start + table_size
+        self._values = self._keys + self._key_offsets[-1]
+        value_type = self.header["values"]
+        self._row_type = getattr(data_types, value_type, None)
+        self._decode = {
+            "set": lambda value: True,
+            "tuple": lambda value: tuple(json.loads(value)),
+            "json": json.loads,
+        }.get(value_type, self._decode_rows)
+
+    def changes(self) -> list[str]:
+        """
+        What changed since the lexicon was built: the source files and the schema
+        """
+        changes = [
+            path
+            for path, digest in self.header["sources"].items()
+            if not os.path.exists(path) or source_digest(path) != digest
+        ]
+        if self.header.get("schema") != row_schema(self.header["values"]):
+            changes.append(f"the columns of {self.header['values']}")
+        return changes
+
+    def _key(self, i: int) -> bytes:
+        offsets = self._key_offsets
+        return self._map[self._keys + offsets[i] : self._keys + offsets[i + 1]]
+
+    def _find(self, key: Any) -> int:
+        try:
+            target = encode_key(key)
+        except (AttributeError, TypeError):
+            return -1
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._key(low) == target:
+            return low
+        return -1
+
+    def _decode_rows(self, value: bytes) -> tuple:
+        row_type = self._row_type
+        return tuple(row_type(row) for row in json.loads(value))  # type: ignore
+
+    def __getitem__(self, key: Any) -> Any:
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._value(i)
+
+    def _value(self, i: int) -> Any:
+        offsets = self._value_offsets
+        start = self._values + offsets[i]
+        return self._decode(self._map[start : self._values + offsets[i + 1]])
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        # most lookups of the stemmers miss
+        i = self._find(key)
+        return default if i < 0 else self._value(i)
+
+    def __contains__(self, key: object) -> bool:
+        return self._find(key) >= 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator:
+        tuple_keys = self.header["tuple_keys"]
+        for i in range(self.count):
+            key = self._key(i).decode()
+            yield tuple(key.split(key_separator)) if tuple_keys else key
+
+
+def open_mapped(directory: str, name: str) -> MappedLexicon | None:
+    """
+    The mapped lexicon `name` in the directory,
+    None if it doesn't exist or its sources have changed
+    """
+    path = os.path.join(directory, f"{name}.lex")
+    if not os.path.exists(path):
+        return None
+    lexicon = MappedLexicon(path)
+    if changes := lexicon.changes():
+        warnings.warn(
+            f"{path} is out of date ({', '.join(changes)} changed) and is ignored, "
+            "rebuild it with tools/build_lexicons.py"
+        )
+        return None
+    return lexicon
+
+
+class SQLiteTable(NamedTuple):
+    database: str
+    rows: str
+    """
+    The rows of a key in the order of the JSON file (which is the order
+    of the rowids), the key is bound to ?1 (and ?2 for tuple keys)
+    """
+    keys: str
+    decode: Callable[[list[sqlite3.Row]], Any]
+
+
+def _entry(row: sqlite3.Row) -> dict:
+    # the JSON files don't have the ids
+    return {key: row[key] for key in row.keys() if key.lower() != "id"}
+
+
+def _rows(row_type: type[data_types.LexiconRow]) -> Callable[[list], tuple]:
+    return lambda rows: tuple(row_type.from_entry(_entry(row), {}) for row in rows)
+
+
+sqlite_tables: dict[str, SQLiteTable] = {
+    "noun_dict": SQLiteTable(
+        "arabicdictionary.sqlite",
+        "SELECT * FROM nouns WHERE normalized = ? ORDER BY rowid",
+        "SELECT DISTINCT normalized FROM nouns",
+        _rows(data_types.NounRow),
+    ),
+    "verb_dict": SQLiteTable(
+        "arabicdictionary.sqlite",
+        "SELECT * FROM verbs WHERE stamped = ? ORDER BY rowid",
+        "SELECT DISTINCT stamped FROM verbs",
+        _rows(data_types.VerbRow),
+    ),
+    "short_verb_stamps": SQLiteTable(
+        "arabicdictionary.sqlite",
+        "SELECT 1 FROM verbs WHERE stamped = ? AND length(stamped) <= 4 LIMIT 1",
+        "SELECT DISTINCT stamped FROM verbs WHERE length(stamped) <= 4",
+        lambda rows: True,
+    ),
+    "stopword_dict": SQLiteTable(
+        "stopwords.sqlite",
+        "SELECT * FROM classedstopwords WHERE WORD = ? ORDER BY rowid",
+        "SELECT DISTINCT WORD FROM classedstopwords",
+        lambda rows: [_entry(row) for row in rows],
+    ),
+    # the later entries overwrite the earlier ones in data.py
+    "unknown_dict": SQLiteTable(
+        "wordfreq.sqlite",
+        "SELECT * FROM wordfreq WHERE unvocalized = ? ORDER BY rowid DESC LIMIT 1",
+        "SELECT DISTINCT unvocalized FROM wordfreq",
+        lambda rows: _entry(rows[0]),
+    ),
+    "freq_dict": SQLiteTable(
+        "wordfreq.sqlite",
+        "SELECT freq FROM wordfreq WHERE (vocalized = ?1 OR unvocalized = ?1) "
+        "AND word_type = ?2 ORDER BY rowid DESC LIMIT 1",
+        "SELECT vocalized, word_type FROM wordfreq "
+        "UNION SELECT unvocalized, word_type FROM wordfreq",
+        lambda rows: rows[0]["freq"],
+    ),
+}
+"""The lexicons a SQLite lexicon can serve, the others are read from the JSON files"""
+
+_missing = object()
+
+
+class SQLiteLexicon(Mapping):
+    """
+    A read-only mapping on a table of a SQLite database
+    with a connection per thread and a small LRU cache in front
+    """
+
+    def __init__(self, name: str, path: str, table: SQLiteTable):
+        self.table = table
+        # immutable: the database is never written, so sqlite doesn't lock it
+        self._uri = f"{Path(path).resolve().as_uri()}?mode=ro&immutable=1"
+        self._local = local()
+        self._cache: LRUCache = LRUCache(
+            sqlite_cache_size, f"sqlite_{name}", estimate_size
+        )
+        # fails early if the database doesn't exist
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections can't be shared between threads or forked processes
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self._uri, uri=True)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        value = self._cache.get(key, _missing)
+        if value is _missing:
+            parameters = key if isinstance(key, tuple) else (key,)
+            try:
+                rows = self._connection().execute(self.table.rows, parameters)
+            except sqlite3.ProgrammingError:
+                # a key of the wrong shape, like a str for freq_dict
+                return default
+            rows = rows.fetchall()
+            # misses are remembered too, most lookups of the stemmers miss
+            value = self._cache.put(key, self.table.decode(rows) if rows else None)
+        return default if value is None else value
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self.get(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return self.get(key, _missing) is not _missing
+
+    def __len__(self) -> int:
+        query = f"SELECT COUNT(*) FROM ({self.table.keys})"
+        return self._connection().execute(query).fetchone()[0]
+
+    def __iter__(self) -> Iterator:
+        for row in self._connection().execute(self.table.keys):
+            yield row[0] if len(row) == 1 else tuple(row)
+
+
+def arramooz_data() -> str:
+    """
+    The directory of the databases that come with arramooz
+    """
+    import arramooz
+
+    return os.path.join(os.path.dirname(arramooz.__file__), "data")
+
+
+def open_sqlite(directory: str, name: str) -> SQLiteLexicon | None:
+    """
+    The lexicon `name` on the database in the directory,
+    None if it isn't one of the `sqlite_tables`
+    """
+    if (table := sqlite_tables.get(name)) is None:
+        return None
+    return SQLiteLexicon(name, os.path.join(directory, table.database), table)
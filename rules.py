@@ -0,0 +1,854 @@
+"""
+The rules module compiles the character maps from the data module into rule sets
+
+A rule set is the ordered list of (pattern, replacement) pairs that turns an analyzed
+Arabic word into its transliteration. Which maps make up a rule set only depends on a
+handful of flags (the profile plus idafah and nisba of the token), so every
+combination is compiled once and then shared by all tokens and requests.
+"""
+
+import inspect
+import json
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import cache
+from itertools import product
+from typing import Callable, Iterable, Iterator, Literal, NamedTuple
+
+import data
+
+Replacement = str | Callable[[re.Match], str]
+RuleSet = tuple[tuple[re.Pattern, Replacement], ...]
+
+
+@cache
+def compile_pattern(pattern: str) -> re.Pattern:
+    """
+    Compiles a pattern once so that all rule sets share the same pattern objects
+    """
+    return re.compile(pattern)
+
+
+def compile_rules(char_map: dict[str, Replacement]) -> RuleSet:
+    return tuple((compile_pattern(arab), latin) for arab, latin in char_map.items())
+
+
+# the scheme of every compiled rule set (only used by the rule profiler)
+rule_set_schemes: dict[RuleSet, str] = {}
+
+# the tables the rule sets are merged from; later tables override earlier ones
+scheme_tables = {
+    "dmg": (
+        "subs",
+        "vowel_map",
+        "begin_hamza_map",
+        "con_map",
+        "diphthong_map",
+        "double_vowels_map",
+        "nisba_map",
+    ),
+    "ijmes": (
+        "subs",
+        "vowel_map",
+        "begin_hamza_map",
+        "ijmes_con_map",
+        "diphthong_map",
+        "ijmes_name_map",
+    ),
+}
+
+
+@cache
+def dmg_rules(
+    ta_marbutah: bool,
+    begin_hamza: bool,
+    diphthongs: bool,
+    double_vowels: bool,
+    nisba: bool,
+    is_idafah: bool,
+) -> RuleSet:
+    """
+    The DMG rule set
+
+    `nisba` is true if either the profile or the token asks for the nisba rules
+    """
+    char_map = (
+        data.subs
+        | data.vowel_map
+        | (
+            {
+                "(?<=[āūī])ة$": "h",
+                "ة$": ("h" if ta_marbutah else ""),
+            }
+            if not is_idafah
+            else {}
+        )
+        | (data.begin_hamza_map if not begin_hamza else {})
+        | data.con_map
+    )
+    if diphthongs:
+        char_map |= data.diphthong_map
+    if not double_vowels:
+        char_map |= data.double_vowels_map
+    if nisba:
+        char_map |= data.nisba_map
+    rules = compile_rules(char_map)
+    rule_set_schemes[rules] = "dmg"
+    return rules
+
+
+@cache
+def ijmes_rules(
+    diphthongs: bool,
+    is_name: bool,
+    is_nisba: bool,
+    is_idafah: bool,
+) -> RuleSet:
+    """
+    The IJMES rule set
+    """
+    char_map = data.subs | data.vowel_map | data.begin_hamza_map | data.ijmes_con_map
+    if not is_idafah:
+        char_map["ة"] = ""
+    if is_nisba:
+        char_map["iyy$"] = "iyya"
+    if diphthongs:
+        char_map |= data.diphthong_map
+    if is_name:
+        char_map |= data.ijmes_name_map
+    rules = compile_rules(char_map)
+    rule_set_schemes[rules] = "ijmes"
+    return rules
+
+
+def apply_rules(rules: RuleSet, word: str, table: dict[int, str] | None = None) -> str:
+    """
+    Applies the rules to the word until none of them matches anymore
+
+    `table` holds the context-free rules that were split off the rule set
+    (see `split_rules`) and is applied at the start of every pass
+    """
+    cont: bool = True
+    while cont:
+        cont = False
+        if table:
+            word = word.translate(table)
+        for pattern, replace in rules:
+            word, n = pattern.subn(replace, word)
+            cont = cont or bool(n)
+    return word
+
+
+# Rule profiler
+# An opt-in instrumentation of `apply_rules` that records which rules fire,
+# how often and how long they take, and how many passes every word needs.
+
+
+def rule_origin(scheme: str, pattern: str) -> str:
+    """
+    The name of the data table a rule comes from or "inline" if it is defined in
+    `dmg_rules`/`ijmes_rules` itself
+    """
+    for table in reversed(scheme_tables.get(scheme, ())):
+        if pattern in getattr(data, table):
+            return table
+    return "inline"
+
+
+class RuleProfiler:
+    """
+    Collects the rule statistics while it is active (see `profile_rules`)
+
+    Rules are identified by their scheme and their pattern
+    """
+
+    def __init__(self):
+        # how often a rule was tried, substituted and changed a word
+        self.calls: Counter[tuple[str, str]] = Counter()
+        self.hits: Counter[tuple[str, str]] = Counter()
+        self.words: Counter[tuple[str, str]] = Counter()
+        # seconds spent in each rule
+        self.time: defaultdict[tuple[str, str], float] = defaultdict(float)
+        # number of words per number of passes until the fixed point
+        self.iterations: Counter[int] = Counter()
+        # an example word for every number of passes
+        self.examples: dict[int, str] = {}
+
+    def apply(self, rules: RuleSet, word: str) -> str:
+        """
+        `apply_rules` with instrumentation
+        """
+        scheme = rule_set_schemes.get(rules, "?")
+        original = word
+        changed_by = set()
+        iterations = 0
+        cont: bool = True
+        while cont:
+            cont = False
+            iterations += 1
+            for pattern, replace in rules:
+                key = (scheme, pattern.pattern)
+                start = time.perf_counter()
+                word, n = pattern.subn(replace, word)
+                self.time[key] += time.perf_counter() - start
+                self.calls[key] += 1
+                if n:
+                    self.hits[key] += n
+                    changed_by.add(key)
+                    cont = True
+        self.words.update(changed_by)
+        self.iterations[iterations] += 1
+        self.examples.setdefault(iterations, original)
+        return word
+
+    def rules(self) -> list[dict]:
+        """
+        The statistics of every rule that was tried, the most expensive first
+        """
+        stats = []
+        for key in sorted(self.calls, key=self.time.__getitem__, reverse=True):
+            scheme, pattern = key
+            stats.append(
+                {
+                    "scheme": scheme,
+                    "table": rule_origin(scheme, pattern),
+                    "pattern": pattern,
+                    "calls": self.calls[key],
+                    "hits": self.hits[key],
+                    "words": self.words[key],
+                    "time": self.time[key],
+                }
+            )
+        return stats
+
+    def report(self) -> str:
+        """
+        A human readable report of the collected statistics
+        """
+        rules = self.rules()
+        words = self.iterations.total()
+        lines = [
+            (
+                f"{words} words, {sum(self.hits.values())} substitutions, "
+                f"{sum(self.time.values()):.3f}s in the rules"
+            ),
+            "",
+            "passes  words  example",
+        ]
+        lines += [
+            f"{passes:>6}  {count:>5}  {self.examples[passes]}"
+            for passes, count in sorted(self.iterations.items())
+        ]
+        lines += [
+            "",
+            (
+                f"{'scheme':<6} {'table':<17} {'pattern':<24} "
+                f"{'hits':>7} {'words':>7} {'time (ms)':>10}"
+            ),
+        ]
+        lines += [
+            f"{rule['scheme']:<6} {rule['table']:<17} {rule['pattern']:<24} "
+            f"{rule['hits']:>7} {rule['words']:>7} {rule['time'] * 1000:>10.2f}"
+            for rule in rules
+        ]
+        dead = [rule for rule in rules if not rule["hits"]]
+        lines += ["", f"{len(dead)} rules never fired:"]
+        lines += [
+            f"{rule['scheme']:<6} {rule['table']:<17} {rule['pattern']}"
+            for rule in dead
+        ]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """
+        Writes the report to the path, as JSON if the path ends with .json
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                json.dump(
+                    {
+                        "iterations": dict(sorted(self.iterations.items())),
+                        "examples": self.examples,
+                        "rules": self.rules(),
+                    },
+                    f,
+                    ensure_ascii=False,
+                    indent=4,
+                )
+            else:
+                f.write(self.report())
+
+
+profiler: RuleProfiler | None = None
+
+
+def active_profiler() -> RuleProfiler | None:
+    return profiler
+
+
+@contextmanager
+def profile_rules() -> Iterator[RuleProfiler]:
+    """
+    Profiles all rule applications inside the with-block
+
+    While profiling, every word is transliterated by `apply_rules`, regardless of
+    the engine, and nothing is served from the rendering memo.
+
+    >>> with profile_rules() as profiler:
+    ...     transliterate(text)
+    >>> print(profiler.report())
+    """
+    global profiler
+    previous, profiler = profiler, RuleProfiler()
+    try:
+        yield profiler
+    finally:
+        profiler = previous
+
+
+# Automaton engine
+# Instead of applying every rule to the whole word until nothing changes,
+# the rules are compiled into a trie with explicit context conditions
+# and the word is scanned once from left to right.
+
+Engine = Literal["regex", "automaton"]
+
+# classes are expanded by testing every character below this code point
+# (covers Latin, the Latin extensions with the dotted letters and Arabic)
+_class_universe = 0x3000
+
+
+def _is_arabic(c: str) -> bool:
+    return "؀" <= c <= "ۿ"
+
+
+def _expand_class(atom: str) -> frozenset[str]:
+    pattern = compile_pattern(atom)
+    return frozenset(
+        c for c in map(chr, range(_class_universe)) if pattern.fullmatch(c)
+    )
+
+
+class AutomatonRule(NamedTuple):
+    index: int
+    """The position in the rule set, lower indices win"""
+    body: tuple[frozenset[str] | None, ...]
+    """The characters the rule consumes, None is any character"""
+    at_start: bool
+    at_end: bool
+    not_at_end: bool
+    behind: frozenset[str] | None
+    ahead: frozenset[str] | None
+    not_ahead: frozenset[str] | None
+    pattern: re.Pattern
+    replace: Replacement
+
+    @property
+    def is_latin(self) -> bool:
+        """
+        Whether the rule only reads Latin characters,
+        meaning it works on the output of the Arabic rules
+        """
+        return all(
+            atom is not None and not any(map(_is_arabic, atom)) for atom in self.body
+        )
+
+
+def _read_atom(pattern: str, i: int) -> tuple[str, int]:
+    if pattern[i] == "[":
+        end = pattern.index("]", i + 1)
+        return pattern[i : end + 1], end + 1
+    if pattern.startswith("(.)", i):
+        return "(.)", i + 3
+    if pattern[i] in "()?^$|*+{}\\":
+        raise ValueError(f"Unsupported pattern for the automaton: {pattern!r}")
+    return pattern[i], i + 1
+
+
+def _atom_chars(atom: str) -> frozenset[str] | None:
+    if atom in (".", "(.)"):
+        return None
+    if atom.startswith("["):
+        return _expand_class(atom)
+    return frozenset(atom)
+
+
+def parse_rule(index: int, pattern: re.Pattern, replace: Replacement) -> AutomatonRule:
+    """
+    Parses the small regex subset used in the data module:
+    `^`, a lookbehind, literals, classes and `(.)`, a (negative) lookahead and `$`
+    """
+    source = pattern.pattern
+    i = 0
+    at_start = source.startswith("^")
+    i += at_start
+    behind = None
+    if source.startswith("(?<=", i):
+        atom, i = _read_atom(source, i + 4)
+        behind = _atom_chars(atom)
+        i += 1  # )
+    body = []
+    while i < len(source) and not source.startswith("(?", i) and source[i] != "$":
+        atom, i = _read_atom(source, i)
+        body.append(_atom_chars(atom))
+    ahead = not_ahead = None
+    not_at_end = False
+    if source.startswith("(?!$)", i):
+        not_at_end = True
+        i += 5
+    elif source.startswith("(?=", i) or source.startswith("(?!", i):
+        negative = source[i + 2] == "!"
+        atom, i = _read_atom(source, i + 3)
+        if negative:
+            not_ahead = _atom_chars(atom)
+        else:
+            ahead = _atom_chars(atom)
+        i += 1  # )
+    at_end = source[i:] == "$"
+    if not body or (i < len(source) and not at_end):
+        raise ValueError(f"Unsupported pattern for the automaton: {source!r}")
+    return AutomatonRule(
+        index,
+        tuple(body),
+        at_start,
+        at_end,
+        not_at_end,
+        behind,
+        ahead,
+        not_ahead,
+        pattern,
+        replace,
+    )
+
+
+class _Node:
+    __slots__ = ("any", "edges", "rules")
+
+    def __init__(self):
+        self.edges: dict[str, _Node] = {}
+        self.any: _Node | None = None
+        self.rules: list[AutomatonRule] = []
+
+    def add(self, rule: AutomatonRule, depth: int = 0):
+        if depth == len(rule.body):
+            self.rules.append(rule)
+            return
+        atom = rule.body[depth]
+        if atom is None:
+            self.any = self.any or _Node()
+            self.any.add(rule, depth + 1)
+            return
+        for c in atom:
+            self.edges.setdefault(c, _Node()).add(rule, depth + 1)
+
+
+class _Stage:
+    """
+    One left-to-right scan over a word with a set of rules
+
+    The decision which rule fires only depends on a short window of the input and
+    the left context, so the decisions are memoized like the states of a lazy DFA.
+    """
+
+    # the number of memoized decisions before they are dropped
+    max_decisions = 100_000
+
+    def __init__(
+        self,
+        rules: list[AutomatonRule],
+        pushback: set[str] | None,
+        swaps: frozenset[int] = frozenset(),
+    ):
+        self.root = _Node()
+        for rule in rules:
+            self.root.add(rule)
+        # replacements containing these letters are scanned again (all if None)
+        self.pushback = pushback
+        # the rules that swap a letter, the later rules already read it swapped
+        self.swaps = swaps
+        self.first_letters = self.root.edges.keys()
+        longest = max((len(rule.body) for rule in rules), default=0)
+        # a rule inside of another rule's span and its lookahead have to be visible
+        self.window = 2 * longest + 1
+        self.decisions: dict[tuple, tuple[int, AutomatonRule] | None] = {}
+
+    def _candidates(self, window: str, offset: int) -> list[tuple[int, AutomatonRule]]:
+        """
+        Finds all rules whose body matches the input at the offset
+        """
+        found = []
+        nodes = [self.root]
+        for length, c in enumerate(window[offset:], 1):
+            next_nodes = []
+            for node in nodes:
+                for child in (node.edges.get(c), node.any):
+                    if child is not None:
+                        next_nodes.append(child)
+                        found.extend((length, rule) for rule in child.rules)
+            if not next_nodes:
+                break
+            nodes = next_nodes
+        return found
+
+    @staticmethod
+    def _holds(
+        rule: AutomatonRule,
+        window: str,
+        is_end: bool,
+        offset: int,
+        length: int,
+        at_start: bool,
+        behind: str,
+    ) -> bool:
+        """
+        Checks the context conditions of a rule matching at the offset
+        """
+        end = offset + length
+        at_end = is_end and end == len(window)
+        next_c = window[end] if end < len(window) else ""
+        return not (
+            (rule.at_start and not at_start)
+            or (rule.at_end and not at_end)
+            or (rule.not_at_end and at_end)
+            or (rule.behind is not None and behind not in rule.behind)
+            or (rule.ahead is not None and next_c not in rule.ahead)
+            or (rule.not_ahead is not None and next_c in rule.not_ahead)
+        )
+
+    def _overruled(
+        self, window: str, is_end: bool, best: AutomatonRule, length: int
+    ) -> bool:
+        """
+        Whether an earlier rule matches inside of the span of the best rule
+        """
+        return any(
+            rule.index < best.index
+            and rule.index not in self.swaps
+            and self._holds(
+                rule, window, is_end, offset, inner_length, False, window[offset - 1]
+            )
+            for offset in range(1, length)
+            for inner_length, rule in self._candidates(window, offset)
+        )
+
+    def _decide(
+        self,
+        window: str,
+        is_end: bool,
+        at_start: bool,
+        last_in: str,
+        last_out: str,
+        barrier: int,
+        seen: tuple[tuple[int, str], ...],
+    ) -> tuple[int, AutomatonRule] | None:
+        """
+        Picks the rule that fires at the head
+
+        In the fixed-point loop, the rules before the one that produced the output
+        left of the head still saw the input, so they are checked against it.
+        If that input came from a replacement that was pushed back, the rules before
+        the one that made it saw what it replaced (`seen`)
+        """
+
+        def holds(length: int, rule: AutomatonRule) -> bool:
+            behind = next((char for limit, char in seen if rule.index < limit), None)
+            if behind is None and rule.index <= barrier:
+                behind = last_in
+            elif behind is None:
+                return self._holds(rule, window, is_end, 0, length, at_start, last_out)
+            return self._holds(rule, window, is_end, 0, length, False, behind)
+
+        matches = sorted(
+            (
+                (length, rule)
+                for length, rule in self._candidates(window, 0)
+                if holds(length, rule)
+            ),
+            key=lambda match: match[1].index,
+        )
+        return next(
+            (
+                (length, rule)
+                for length, rule in matches
+                if not self._overruled(window, is_end, rule, length)
+            ),
+            None,
+        )
+
+    def scan(self, word: str) -> str:
+        out: list[str] = []
+        i = 0
+        # the character left of the head in the input and in the output
+        last_in = last_out = ""
+        # the index of the rule that produced the output left of the head
+        barrier = -1
+        # for every character of the word what the rules before the one that pushed
+        # it back saw there instead, as (rule index, character) pairs
+        seen: list[tuple[tuple[int, str], ...]] = [()] * len(word)
+        last_seen: tuple[tuple[int, str], ...] = ()
+        # protects against rule sets that would loop forever
+        budget = 16 * len(word) + 16
+        decisions = self.decisions
+        if len(decisions) > self.max_decisions:
+            decisions.clear()
+        while i < len(word):
+            if word[i] in self.first_letters or self.root.any is not None:
+                window = word[i : i + self.window]
+                key = (window, i + self.window >= len(word), not out)
+                key += (last_in, last_out, barrier, last_seen)
+                if (best := decisions.get(key, ())) == ():
+                    best = decisions[key] = self._decide(*key)
+            else:
+                best = None
+            if best is None or not budget:
+                last_in = last_out = word[i]
+                last_seen = seen[i]
+                out.append(last_in)
+                barrier = -1
+                i += 1
+                continue
+            budget -= 1
+            length, rule = best
+            matched = word[i : i + length]
+            i += length
+            replace = rule.replace
+            if callable(replace):
+                replace = replace(rule.pattern.fullmatch(matched))  # type: ignore
+            if replace != matched and (
+                self.pushback is None or not self.pushback.isdisjoint(replace)
+            ):
+                # the left context stays the same for the pushed back replacement
+                before = seen[i - 1]
+                pushed = (*(pair for pair in before if pair[0] < rule.index),)
+                pushed += ((rule.index, matched[-1]),)
+                word = replace + word[i:]
+                seen = ([()] * (len(replace) - 1) + [pushed])[: len(replace)] + seen[i:]
+                i = 0
+                continue
+            last_in = matched[-1]
+            last_seen = seen[i - 1]
+            barrier = rule.index
+            if replace:
+                out.append(replace)
+                last_out = replace[-1]
+        return "".join(out)
+
+
+class Automaton:
+    """
+    Transliterates a word in a single left-to-right scan
+
+    Context free rules that only swap Arabic letters (hamza carriers, ...) are folded
+    into a translation table that normalizes the word first, unless an earlier rule
+    reads the letters they swap in (`(?<=ا)ي` runs before the alif maddah becomes an
+    alif). The later rules read the swapped letters as the ones they replace.
+    Then the rules reading Arabic run: at every position one walk of the trie yields
+    all matching rules and their context conditions are checked against the
+    neighbouring characters. The tables rely on their order (`و(?=َ)` has to win
+    over `ُو`), so the earliest rule wins, unless an even earlier rule matches inside
+    of its span. Replacements that still contain Arabic (like the doubling of shaddah)
+    are pushed back onto the input, so the head never moves backwards over the
+    output; the rules before the one that pushed them back still see what was
+    replaced, like they did in the regex engine. Arabic letters left in the output are scanned again until nothing
+    changes. The few rules that only read Latin (diphthongs, nisba, ...) need to see
+    the transliterated neighbours in their lookaheads, so they run as a second scan
+    of the same kind over the output.
+    """
+
+    def __init__(self, rules: RuleSet):
+        parsed = [parse_rule(i, *rule) for i, rule in enumerate(rules)]
+        self.normalization: dict[int, str] = {}
+        arabic: list[AutomatonRule] = []
+        latin: list[AutomatonRule] = []
+        read: set[str] = set()
+        # letters that an earlier rule swaps for another one wherever they are
+        # (like alif maqsurah -> alif), the later rules see them swapped
+        swapped: dict[str, str] = {}
+        swaps: set[int] = set()
+        for rule in parsed:
+            if swapped:
+                rule = self._see_swapped(rule, swapped)
+            if self._is_swap(rule) and read.isdisjoint(rule.body[0]):  # type: ignore
+                # no rule before it may see the new letters either
+                # (`(?<=ا)ي` runs before the alif maddah becomes an alif)
+                if read.isdisjoint(rule.replace):  # type: ignore
+                    for c in rule.body[0]:  # type: ignore
+                        self.normalization[ord(c)] = rule.replace  # type: ignore
+                    continue
+                if len(rule.replace) == 1:  # type: ignore
+                    swapped |= dict.fromkeys(rule.body[0], rule.replace)  # type: ignore
+                    swaps.add(rule.index)
+            if rule.is_latin:
+                latin.append(rule)
+            else:
+                arabic.append(rule)
+            for atom in (*rule.body, rule.behind, rule.ahead, rule.not_ahead):
+                read.update(atom or ())
+        # resolve chains like alif maddah -> hamza + alif
+        for key, value in self.normalization.items():
+            while (translated := value.translate(self.normalization)) != value:
+                value = translated
+            self.normalization[key] = value
+        arabic_letters = {
+            c for rule in arabic for atom in rule.body for c in atom or ()
+        }
+        self.arabic_letters = frozenset(arabic_letters)
+        self.arabic = _Stage(arabic, arabic_letters, frozenset(swaps))
+        self.latin = _Stage(latin, None)
+
+    @staticmethod
+    def _is_swap(rule: AutomatonRule) -> bool:
+        """
+        Whether the rule swaps Arabic letters regardless of their context
+
+        Such a rule is applied to the whole word before everything else,
+        unless an earlier rule reads its letters
+        """
+        return (
+            len(rule.body) == 1
+            and rule.body[0] is not None
+            and isinstance(rule.replace, str)
+            and all(map(_is_arabic, rule.replace))
+            and not (rule.at_start or rule.at_end or rule.not_at_end)
+            and rule.behind is rule.ahead is rule.not_ahead is None
+        )
+
+    @staticmethod
+    def _see_swapped(rule: AutomatonRule, swapped: dict[str, str]) -> AutomatonRule:
+        """
+        In a pass of the regex engine, a rule sees the letters that earlier rules
+        swapped, so it also reads the original letters
+        """
+
+        def see(atom: frozenset[str] | None) -> frozenset[str] | None:
+            if atom is None:
+                return None
+            return atom | {c for c, new in swapped.items() if new in atom}
+
+        return rule._replace(
+            body=tuple(map(see, rule.body)),
+            behind=see(rule.behind),
+            ahead=see(rule.ahead),
+            not_ahead=see(rule.not_ahead),
+        )
+
+    def __call__(self, word: str) -> str:
+        word = self.arabic.scan(word.translate(self.normalization))
+        # a rule can still match across the output and what is left of the input,
+        # like the shaddah after a half vowel that a rule at the start replaced
+        # (`^ي` wins over `يّ`); the regex engine finds these in its next pass
+        while not self.arabic_letters.isdisjoint(word):
+            if (rescanned := self.arabic.scan(word)) == word:
+                break
+            word = rescanned
+        if self.latin.first_letters.isdisjoint(word):
+            return word
+        return self.latin.scan(word)
+
+
+@cache
+def automaton(rules: RuleSet) -> Automaton:
+    return Automaton(rules)
+
+
+# Translate fast path
+# Most consonants are single characters that are replaced regardless of their
+# context. Such rules are applied with one `str.translate` instead of one regex
+# pass each, as long as this can't change the result of the other rules.
+
+
+def _references(rule: AutomatonRule) -> frozenset[str] | None:
+    """
+    All characters the rule reads, None if it reads any character
+    """
+    atoms = [*rule.body, rule.behind, rule.ahead, rule.not_ahead]
+    if None in rule.body:
+        return None
+    return frozenset().union(*(atom for atom in atoms if atom is not None))
+
+
+@cache
+def split_rules(rules: RuleSet) -> tuple[dict[int, str], RuleSet]:
+    """
+    Splits the rules that replace a single character by a constant string into
+    a translation table and returns it with the remaining rules
+
+    A rule is only split off if
+    - no other rule reads its character, so the time of the replacement doesn't
+      matter to the other rules
+    - no earlier rule reads its replacement, which is now there earlier
+    - the replacement isn't empty (which could join characters around it) and it is
+      a single character if a rule copies any character (like the shaddah rule)
+    """
+    try:
+        parsed = [
+            parse_rule(index, pattern, replace)
+            for index, (pattern, replace) in enumerate(rules)
+        ]
+    except ValueError:
+        return {}, rules
+    references = [_references(rule) for rule in parsed]
+    wildcard = None in references
+    table: dict[str, str] = {}
+    for rule in parsed:
+        char, replace = rule.pattern.pattern, rule.replace
+        if (
+            len(char) != 1
+            or rule.body[0] is None
+            or not isinstance(replace, str)
+            or not replace
+            or (wildcard and len(replace) != 1)
+        ):
+            continue
+        if any(
+            refs is not None and char in refs
+            for index, refs in enumerate(references)
+            if index != rule.index
+        ):
+            continue
+        if any(
+            refs is not None and not refs.isdisjoint(replace)
+            for refs in references[: rule.index]
+        ):
+            continue
+        table[char] = replace
+    # resolve chains like ḥ -> h (names) so that one translation suffices
+    for char, replace in table.items():
+        for _ in table:
+            if (resolved := replace.translate(str.maketrans(table))) == replace:
+                break
+            replace = resolved
+        table[char] = replace
+    rest = tuple(
+        (pattern, replace) for pattern, replace in rules if pattern.pattern not in table
+    )
+    return str.maketrans(table), rest
+
+
+def transliterate_word(rules: RuleSet, word: str, engine: Engine = "regex") -> str:
+    """
+    Transliterates a single word with the given engine
+    """
+    if profiler is not None:
+        return profiler.apply(rules, word)
+    if engine == "automaton":
+        return automaton(rules)(word)
+    table, rest = split_rules(rules)
+    return apply_rules(rest, word, table)
+
+
+def build_rule_sets(engines: Iterable[Engine] = ("regex", "automaton")):
+    """
+    Compiles the rule sets of every combination of flags ahead of time,
+    together with what the engines make of them
+    """
+    for rule_set in (dmg_rules, ijmes_rules):
+        flag_count = len(inspect.signature(rule_set).parameters)
+        for flags in product((False, True), repeat=flag_count):
+            rules = rule_set(*flags)
+            if "regex" in engines:
+                split_rules(rules)
+            if "automaton" in engines:
+                automaton(rules)
@@ -1,7 +1,38 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from tashaphyne.stemming import ArabicLightStemmer
+
 import arab_tools
+import caches
 import data
-from data_types import IJMESProfile, NameProfile
-from trans import Profile, transliterate, transliterate_ijmes
+import lexicons
+import rules
+import trans
+from arab_tools import nounstemmer
+from arab_tools.lightstemmer import LightStemmer, verify_affix
+from data_types import Analysis, IJMESProfile, NameProfile, NounRow, Token
+from rules import apply_rules, dmg_rules, ijmes_rules, profile_rules, split_rules
+from trans import (
+    Profile,
+    analyze,
+    cached_analysis,
+    render,
+    render_token,
+    rerender,
+    transliterate,
+    transliterate_ijmes,
+    transliterate_incremental,
+    transliterate_many,
+    transliterate_multi,
+    transliterate_stream,
+)
+from unknown_words import UnknownWords, read_counts
 
 profile_pausa = Profile(pausa=True)
 
@@ -354,6 +385,479 @@ def test_ijmes():
     assert transliterate_ijmes("الله", name_profile) == "Allah"
 
 
+def test_automaton_engine():
+    texts = [
+        "الشَجَرَةُ في الحَديقَةِ كَبيرَةٌ",
+        "مَدِينَةُ القَاهِرَةِ",
+        "أَوَّل قُوَّة نِيَّة نَبِيٌّ العَرَبِيّ",
+        "هَذَا احْتِمَالٌ عَظِيمٌ",
+        "ﻗﺎﻟﻮا رَأَوا قُرآن أَوقاف",
+        "أَبُو عَبْدِ الله مُحَمَّدٌ ابْنُ بَطّوطَةَ",
+        # a half vowel with shaddah at the start of a token
+        "يّ",
+        "وّ",
+        # unvocalized, the swaps and the pushed back replacements have to keep
+        # the order of the rules
+        "رواية الروايات آية آوى إِلَى",
+        "اعلن اتحاد صناعة السيارات في المانيا امس الاول",
+    ]
+    profiles = [
+        Profile(),
+        Profile(pausa=True, ta_marbutah=True, diphthongs=True),
+        Profile(double_vowels=False, nisba=False, begin_hamza=True),
+        NameProfile(),
+    ]
+    for text in texts:
+        for profile in profiles:
+            assert transliterate(text, profile, engine="automaton") == transliterate(
+                text, profile
+            )
+        for profile in (IJMESProfile(), IJMESProfile(is_name=True, diphthongs=True)):
+            assert transliterate_ijmes(
+                text, profile, engine="automaton"
+            ) == transliterate_ijmes(text, profile)
+    assert transliterate("يّ", engine="automaton") == "yy"
+    assert transliterate_ijmes("وّ", engine="automaton") == "ww"
+
+
+def test_render_memo():
+    text = "كِتَابٌ كَبِيرٌ. كِتَابٌ كَبِيرٌ. كِتَابٌ كَبِيرٌ."
+    expected = transliterate(text)
+    cache = render_token.cache
+    cache.clear()
+    hits = cache.hits
+    assert transliterate(text) == expected
+    # the repeated words are rendered from the memo
+    assert cache.hits - hits >= 2
+    misses = cache.misses
+    assert transliterate(text) == expected
+    assert cache.misses == misses
+    assert "render_token" in caches.stats()
+    # dmg and ijmes renderings don't collide
+    assert transliterate_ijmes("في") == "fī"
+
+
+def test_rule_profiler():
+    text = "كِتَابٌ كَبِيرٌ. كِتَابٌ كَبِيرٌ."
+    expected = transliterate(text)
+    with profile_rules() as profiler:
+        # the memo is bypassed, so both sentences are seen
+        assert transliterate(text, engine="automaton") == expected
+    assert profiler.iterations.total() == 4
+    assert profiler.hits[("dmg", "ك")] == 4
+    rules = {rule["pattern"]: rule for rule in profiler.rules()}
+    assert rules["ك"]["table"] == "con_map"
+    assert rules["ك"]["words"] == 4
+    assert "never fired" in profiler.report()
+    # profiling is over
+    transliterate(text)
+    assert profiler.iterations.total() == 4
+
+
+def test_split_rules():
+    rules = ijmes_rules(False, True, False, False)
+    table, rest = split_rules(rules)
+    # context-free consonants are translated, the rest stays on the regex path
+    assert table[ord("ب")] == "b"
+    assert table[ord("ح")] == "h"
+    assert ord("ث") not in table  # "th" would be doubled wrongly by the shaddah rule
+    assert ord("و") not in table
+    assert len(rest) + len(table) == len(rules)
+    words = ["مُحَمَّدٌ", "الثَّوْرَةُ", "حَيَّ", "قُرْءَانٌ", "عَلِيّ", "صَلَاحُ"]
+    for rule_set in (rules, dmg_rules(True, True, True, False, True, False)):
+        table, rest = split_rules(rule_set)
+        for word in words:
+            assert apply_rules(rest, word, table) == apply_rules(rule_set, word)
+
+
+def test_analysis_render():
+    text = "مَكتَبَةُ الأُستاذِ. هُم الكُتّابُ في المَدينَةِ"
+    analysis = analyze(text)
+    # analysis and rendering are independent
+    analysis = Analysis.from_dict(json.loads(json.dumps(analysis.to_dict())))
+    for profile in (
+        Profile(),
+        Profile(ta_marbutah=True, diphthongs=True, begin_hamza=True),
+        Profile(double_vowels=False, nisba=False),
+    ):
+        assert render(analysis, profile) == transliterate(text, profile)
+
+    key, _ = cached_analysis(text)
+    profile = Profile(ta_marbutah=True)
+    assert rerender(key, profile) == transliterate(text, profile)
+    # the analysis options change, so it is analyzed again
+    profile = Profile(pausa=True)
+    assert rerender(key, profile) == transliterate(text, profile)
+    assert rerender("unknown") is None
+
+
+def test_stream():
+    text = "  هُم\nالكُتّابُ؟ عَن الْكِتابُ. اِنكَسَرَ ـ الشَجَرَةُ في الحَديقَةِ  "
+    expected = transliterate(text)
+    for size in (1, 2, 5, len(text)):
+        chunks = (text[i : i + size] for i in range(0, len(text), size))
+        sentences = [*transliterate_stream(chunks)]
+        # the hamzatul wasl is carried from one sentence to the next
+        assert "".join(sentences) == expected
+    assert len(sentences) == 4
+
+
+def test_stream_without_stops():
+    # every chunk only scans its own text, so this takes linear time
+    start = time.perf_counter()
+    sentences = [*trans.clean_sentences(["كتب "] * 40_000)]
+    latin = [*trans.clean_sentences(["abc "] * 40_000)]
+    assert time.perf_counter() - start < 10
+    assert "".join(sentences) == trans.clean("كتب " * 40_000)
+    assert "".join(latin) == trans.clean("abc " * 40_000)
+    # cut as soon as a chunk makes it too long
+    assert max(map(len, sentences + latin)) <= trans.max_sentence_length + 4
+    # a sentence is only cut before a token
+    assert all(sentence.startswith("كتب") for sentence in sentences)
+
+
+def test_incremental():
+    text = "هُم\nالكُتّابُ. كِتابٌ كَبيرٌ. مَكتَبَةُ الأُستاذِ"
+    assert transliterate_incremental("test", text) == (
+        0,
+        0,
+        ["hum\n", "ul-kuttābu. ", "kitābun kabīrun. ", "maktabatu l-ustāḏi"],
+    )
+    # only the edited sentence is sent again
+    text = text.replace("كَبيرٌ", "صَغيرٌ")
+    assert transliterate_incremental("test", text) == (2, 3, ["kitābun ṣaġīrun. "])
+    # the next sentence changes too because it starts with a hamzatul wasl
+    text = text.replace("هُم", "هُوَ")
+    assert transliterate_incremental("test", text) == (0, 2, ["huwa\n", "l-kuttābu. "])
+    # a client that tracks the revision gets everything if the server lost it
+    outputs = ["huwa\n", "l-kuttābu. ", "kitābun ṣaġīrun. ", "maktabatu l-ustāḏi"]
+    assert transliterate_incremental("rev", text, revision=0) == (0, 0, outputs)
+    assert transliterate_incremental("rev", text, revision=1, count=4) == (4, 4, [])
+    trans._live_documents.clear()
+    assert transliterate_incremental("rev", text, revision=2, count=4) == (
+        0,
+        4,
+        outputs,
+    )
+    # or if another process answered in between
+    assert transliterate_incremental("rev", text, revision=5, count=4)[:2] == (0, 4)
+
+
+def test_incremental_routes():
+    import app
+
+    client = app.app.test_client()
+    text = "مُحَمَّد بن عَبدِ الله. أَحمَد"
+    for route, profile in (("", Profile()), ("/names", NameProfile())):
+        body = {"document": route, "text": text, "profile": {}, "revision": 0}
+        answer = client.post(f"/transliterate{route}/incremental", json=body).json
+        expected = transliterate(text, profile)
+        assert answer["revision"] == 1 and "".join(answer["sentences"]) == expected
+        # the server lost the document, the client's sentences are replaced
+        trans._live_documents.clear()
+        body |= {"revision": 1, "count": len(answer["sentences"])}
+        again = client.post(f"/transliterate{route}/incremental", json=body).json
+        assert again == answer | {"stop": body["count"], "revision": 2}
+
+
+def test_many():
+    texts = ["مُحَمَّد بن عَبدِ الله", "", "كِتابُ الأَغاني. هُم الكُتّابُ", "كِتابُ الأَغاني"]
+    texts += texts
+    for profile in (Profile(), NameProfile()):
+        assert transliterate_many(texts, profile) == [
+            transliterate(text, profile) for text in texts
+        ]
+
+
+def test_parallel(monkeypatch):
+    monkeypatch.setattr(trans, "min_shard_length", 10)
+    text = "هُم\nالكُتّابُ. كِتابٌ كَبيرٌ. هُوَ\nالكِتابُ. مَكتَبَةُ الأُستاذِ. اِنكَسَرَ"
+    # the shards start in the middle of hamzatul wasl constructions
+    assert transliterate(text, workers=2) == transliterate(text)
+    # another worker count doesn't take the pool away from running requests
+    with ThreadPoolExecutor(4) as threads:
+        outputs = threads.map(lambda n: transliterate(text, workers=n), [2, 3] * 4)
+        assert set(outputs) == {transliterate(text)}
+
+
+def test_token():
+    text = "كِتابٌ، قَلَمٌ"
+    token = Token(text, 0, 6, 2)
+    assert token.arab == token.original == "كِتابٌ"
+    assert token.after == "، "
+    assert token.latin_after == ", "
+    token.arab = "كِتاب"
+    assert token.original == "كِتابٌ"
+    # the tokens share the text
+    assert len({id(token.text) for token in analyze(text).tokens}) == 1
+
+
+def test_multi():
+    text = "عَبدُ الله بنُ مُحَمَّدٍ. كِتابُ الأَغاني"
+    profiles = {
+        "dmg": Profile(),
+        "names": NameProfile(),
+        "ijmes": IJMESProfile(is_name=True),
+    }
+    assert transliterate_multi(text, profiles) == {
+        "dmg": transliterate(text, profiles["dmg"]),
+        "names": transliterate(text, profiles["names"]),
+        "ijmes": transliterate_ijmes(text, profiles["ijmes"]),
+    }
+    with pytest.raises(TypeError):
+        transliterate_multi(text, {"ijmes": Profile()})
+
+
+def test_cache_registry(monkeypatch):
+    caches.clear()
+    cache = caches.LRUCache(2, "test", caches.estimate_size)
+    try:
+        cache.put("a", "1")
+        cache.put("b", "2")
+        assert cache.get("a") == "1"
+        cache.put("c", "3")
+        assert cache.get("b") is None
+        assert caches.stats()["test"] == {
+            "items": 2,
+            "maxsize": 2,
+            "bytes": cache.bytes,
+            "hits": 1,
+            "misses": 1,
+            "evictions": 1,
+        }
+        # over budget the biggest cache makes room
+        monkeypatch.setattr(caches, "memory_budget", cache.bytes - 1)
+        cache.put("c", "4")
+        assert len(cache) == 1 and cache.get("c") == "4"
+        caches.clear()
+        assert not len(cache) and not cache.bytes
+    finally:
+        del caches.registry["test"]
+
+
+def test_persistent_cache(tmp_path, monkeypatch):
+    # both are restored (removed) after the test
+    monkeypatch.setattr(arab_tools, "persistent_cache", None)
+    monkeypatch.setitem(caches.registry, "persistent_check_word", None)
+    text = "كِتابُ الأَغاني. هُم الكُتّابُ"
+    expected = transliterate(text)
+    path = str(tmp_path / "analysis.sqlite3")
+    for _ in range(2):
+        arab_tools.use_persistent_cache(path)
+        arab_tools.cached_check_word.cache.clear()
+        assert transliterate(text) == expected
+    assert arab_tools.persistent_cache.hits
+    # only an explicit clear empties what the other processes share
+    caches.clear()
+    assert len(arab_tools.persistent_cache)
+    caches.clear(persistent=True)
+    assert not len(arab_tools.persistent_cache)
+    assert transliterate(text) == expected
+    # other versions of the lexicon don't see the entries
+    monkeypatch.setattr(arab_tools, "analysis_version", "other")
+    arab_tools.use_persistent_cache(path)
+    assert not len(arab_tools.persistent_cache)
+
+
+def test_lazy_lexicons():
+    # a fresh process, the lexicons of this one are already loaded
+    script = (
+        "import app, data, sys;"
+        "app.app.test_client().get('/book');"
+        "print(sorted(data.loaded_lexicons()), 'mishkal' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    # nor is the vocalizer imported
+    assert result.stdout.strip() == "[] False"
+    assert len(data.verb_dict) and "verb_dict" in data.loaded_lexicons()
+    assert not hasattr(data, "no_such_lexicon")
+
+
+def test_mapped_lexicon(tmp_path, monkeypatch):
+    source = tmp_path / "source.json"
+    source.write_text("[]")
+    nouns = {key: data.noun_dict[key] for key in ["كتاب", "قلم", "بيت"]}
+    freqs = {("كتاب", "noun"): 5, ("كتب", "verb"): 3}
+    for name, lexicon in [("nouns", nouns), ("freqs", freqs), ("stamps", {"كتب"})]:
+        lexicons.write_mapped(str(tmp_path / f"{name}.lex"), lexicon, [str(source)])
+        mapped = lexicons.open_mapped(str(tmp_path), name)
+        assert mapped is not None and len(mapped) == len(lexicon)
+        assert set(mapped) == set(lexicon) and "بحر" not in mapped
+        if isinstance(lexicon, dict):
+            assert {key: mapped[key] for key in lexicon} == lexicon
+            assert mapped.get("بحر", ()) == ()
+    row = lexicons.open_mapped(str(tmp_path), "nouns")["قلم"][0]  # type: ignore
+    assert isinstance(row, NounRow) and row["root"] == nouns["قلم"][0]["root"]
+    # changed columns make it stale, but not other changes of data_types.py
+    assert data.lexicon_sources["noun_dict"] == ["data/nouns.json"]
+    monkeypatch.setattr(NounRow, "columns", {**NounRow.columns, "new": 7})
+    with pytest.warns(UserWarning, match="columns of NounRow"):
+        assert lexicons.open_mapped(str(tmp_path), "nouns") is None
+    monkeypatch.undo()
+    assert lexicons.open_mapped(str(tmp_path), "nouns") is not None
+    # changed sources make it stale
+    source.write_text("[1]")
+    lexicons.source_digest.cache_clear()
+    with pytest.warns(UserWarning, match="source.json"):
+        assert lexicons.open_mapped(str(tmp_path), "freqs") is None
+
+
+def test_sqlite_lexicon():
+    directory = lexicons.arramooz_data()
+    nouns = lexicons.open_sqlite(directory, "noun_dict")
+    freqs = lexicons.open_sqlite(directory, "freq_dict")
+    assert nouns is not None and freqs is not None
+    assert lexicons.open_sqlite(directory, "sem_relations") is None
+    for key in ["كتاب", "مؤجر", "ءمكن"]:
+        assert nouns.get(key, ()) == data.noun_dict.get(key, ())
+    assert "كتاب" in nouns and nouns.get("كتاب") is nouns.get("كتاب")
+    key = next(iter(data.freq_dict))
+    assert freqs[key] == data.freq_dict[key]
+    assert "كتاب" not in freqs and freqs.get(("كتاب", "none"), 0) == 0
+
+
+def test_preload(monkeypatch):
+    import app
+
+    frozen = []
+    monkeypatch.setattr(app.gc, "freeze", lambda: frozen.append(True))
+    app.preload(word_count=20)
+    assert frozen
+    # every rule set is already built
+    built = rules.split_rules.cache_info().misses, rules.automaton.cache_info().misses
+    rules.build_rule_sets()
+    assert built == (
+        rules.split_rules.cache_info().misses,
+        rules.automaton.cache_info().misses,
+    )
+    assert data.loaded_lexicons() == data.lexicon_sources.keys()
+
+
+@pytest.mark.skipif(
+    not os.environ.get("STARTUP_BUDGET"), reason="timing, set STARTUP_BUDGET=1"
+)
+def test_startup_budget():
+    # relative to a baseline of the same run, see tools/startup_budget.py
+    # (its report is in the captured output)
+    subprocess.run(
+        [sys.executable, "tools/startup_budget.py", "--runs", "2"], check=True
+    )
+
+
+def test_frequent_words(tmp_path, monkeypatch):
+    monkeypatch.setattr(arab_tools, "frequent_words", {})
+    result = arab_tools.check_word("كتاب", "n")
+    path = tmp_path / "frequent_words.json"
+    row = ["كتاب", "n", *result[:-1], "from the table"]
+    data.write(path, {"version": "stale", "words": [row]})
+    assert not arab_tools.load_frequent_words(path)
+    data.write(path, {"version": arab_tools.analysis_key(), "words": [row]})
+    assert arab_tools.load_frequent_words(path)
+    assert arab_tools.check_word("كتاب", "n") == tuple(row[2:])
+
+
+def test_unknown_words(tmp_path):
+    path = str(tmp_path / "unknown.txt")
+    words = UnknownWords(path, max_words=2, max_file_size=5, backups=1)
+    for word in ["a", "b", "a", "c"]:
+        words.add(word)
+    assert words.top() == [("a", 2), ("b", 1)] and words.dropped == 1
+    words.flush()
+    words.add("a")
+    # the file is too big now and is rotated
+    words.flush()
+    assert read_counts(path, 1) == {"a": 3, "b": 1}
+    assert os.path.exists(path + ".1")
+    # a forked process doesn't flush the words it inherited
+    words.add("b")
+    words._pid = -1
+    words.flush()
+    assert read_counts(path, 1) == {"a": 3, "b": 1}
+
+
+def test_unknown_words_counted():
+    word = "ثثثخخخ"
+    count = arab_tools.unknown_words.counts[word]
+    # also when the result comes from a cache
+    for _ in range(3):
+        assert not arab_tools.check_word(word, "n")[-1]
+    assert arab_tools.unknown_words.counts[word] == count + 3
+    # the parts of a word are looked up without counting them
+    assert not arab_tools.check_word("وَثثثخخخ", "n")[-1]
+    assert arab_tools.unknown_words.counts[word] == count + 3
+
+
+def test_light_stemmer():
+    original = nounstemmer.comp_stemmer
+    stemmer = LightStemmer.like(original)
+    word = "بالكتابين"
+    segments = stemmer.segment(word)
+    assert stemmer.segment(word) is segments
+    assert set(segments) == ArabicLightStemmer.segment(original, word)
+    affixes = nounstemmer.SNC.COMP_NOUN_AFFIXES
+    assert verify_affix(word, segments, affixes) == [
+        s for s in segments if f"{word[: s[0]]}-{word[s[1] :]}" in affixes
+    ]
+
+
+def test_noun_stemmer():
+    candidates = {
+        "والمكتبة": [
+            ("وال", "", "ة", "مكتب"),
+            ("وال", "", "", "مكتبة"),
+            ("وال", "", "ي", "مكتبة"),
+        ],
+        "بمدرستها": [("ب", "ها", "ة", "مدرس"), ("ب", "ها", "", "مدرسة")],
+        # the variants of the stem before the enclitic
+        "أبناؤه": [
+            ("أ", "ه", "", "بناء"),
+            ("", "ه", "", "ءبناء"),
+            ("أب", "ه", "", "ناءي"),
+        ],
+    }
+    for noun, expected in candidates.items():
+        assert [c[:4] for c in nounstemmer.noun_candidates(noun)] == expected
+    vocalized = {
+        "القاهرة": {"الْقَاهِرَةَ", "الْقَاهِرَةُ", "الْقَاهِرَةِ"},
+        "بمدرستها": {"بِمَدْرَسَتِهَا", "بِمُدَرِّسَتِهَا"},
+        "أبناؤه": {
+            *("أَبَنَّاءَهُ", "أَبَنَّاءَهِ", "أَبَنَّاؤُهُ", "أَبَنَّاؤُهِ", "أَبَنَّائِهِ"),
+            *("أَبِنَاءَهُ", "أَبِنَاءَهِ", "أَبِنَاؤُهُ", "أَبِنَاؤُهِ", "أَبِنَائِهِ"),
+            *("أَبِنَائِيِهِ", "أَبْنَاءَهُ", "أَبْنَاءَهِ", "أَبْنَاؤُهُ", "أَبْنَاؤُهِ"),
+            "أَبْنَائِهِ",
+        },
+    }
+    for noun, expected in vocalized.items():
+        assert {case.vocalized for case in nounstemmer.stem_noun(noun)} == expected
+
+
+def test_verb_stamp():
+    dictionary = arab_tools.verbstemmer.verb_dictionary
+    for word in ["كتب", "استأذن", "مدّ", "رأى", "تقاتلوا", "سررت"]:
+        assert arab_tools.verb_stamp(word) == dictionary.word_stamp(word)
+    assert arab_tools.verbstemmer.exists_as_stamp("كتب")
+    assert not arab_tools.verbstemmer.exists_as_stamp("كسرنكسر")
+
+
+def test_lexicon_row():
+    intern = {}
+    entry = {"vocalized": "كِتَابٌ", "root": "كتب", "hm_suffix": 1, "k_prefix": 0}
+    row = NounRow.from_entry(entry, intern)
+    assert row["vocalized"] == "كِتَابٌ" and row.get("root", "") == "كتب"
+    assert row["hm_suffix"] is True and row["k_prefix"] is False
+    assert row.get("note") is None
+    with pytest.raises(KeyError):
+        row["note"]
+    # the positions are an implementation detail
+    with pytest.raises(TypeError):
+        row[0]
+    # equal strings are shared between the rows
+    copy = {**entry, "root": "كتب".encode().decode()}
+    assert NounRow.from_entry(copy, intern)["root"] is row["root"]
+
+
 if __name__ == "__main__":
     # test_prepositions()
     # test_transliteration_robustness()
@@ -0,0 +1,53 @@
+"""
+What the tools share: the repository on the import path, the default corpora
+and the errors the analysis may raise
+
+Every tool imports from here before it imports the modules of the repository
+"""
+
+import sys
+from pathlib import Path
+
+root = Path(__file__).resolve().parent.parent
+if str(root) not in sys.path:
+    sys.path.insert(0, str(root))
+
+default_corpora = [
+    "data/ibrahim-in.txt",
+    "data/dmg-examples.txt",
+    "data/ijmes-data.txt",
+    "data/ijmes-prompt.txt",
+    # unvocalized news
+    "data/ner-gold-standard/news.txt",
+]
+tagged_sentences = 100
+"""How many sentences of a tagged corpus (one token per line) are read"""
+
+# what the stemmers raise on some words, anything else is a bug
+analysis_errors = (KeyError, IndexError, ValueError)
+error_prefix = "failed: "
+
+
+def read_corpus(path: str) -> list[str]:
+    """
+    The lines of the corpus, whole (the Latin of the examples is passed through)
+
+    A tagged corpus (a token and its tag per line, like the NER gold standard)
+    is joined back into its first `tagged_sentences` sentences
+    """
+    with open(path, encoding="utf-8-sig") as f:
+        lines = [line.strip() for line in f if not line.startswith("#")]
+    lines = [line for line in lines if line]
+    if not lines or "\t" not in lines[0]:
+        return lines
+    sentences: list[str] = []
+    tokens: list[str] = []
+    for line in lines:
+        token = line.split("\t")[0].replace("\u200e", "")
+        tokens.append(token)
+        if token == ".":
+            sentences.append(" ".join(tokens))
+            tokens = []
+            if len(sentences) == tagged_sentences:
+                break
+    return sentences
@@ -0,0 +1,43 @@
+"""
+Analyzes the most frequent words of data/wordfreq.json with all plausible tags
+and writes the results of check_word to a table that check_word consults first
+
+The table is only used as long as the lexicon doesn't change (see analysis_key)
+
+Usage: py tools/build_frequent_words.py [-n 20000] [-o data/frequent_words.json]
+"""
+
+import argparse
+import json
+import sys
+
+from _common import analysis_errors
+
+import arab_tools
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--count", type=int, default=20000)
+    parser.add_argument("-o", "--output", default=arab_tools.frequent_words_path)
+    args = parser.parse_args()
+
+    words = arab_tools.most_frequent_words(args.count)
+    # the table must not answer for itself
+    arab_tools.frequent_words.clear()
+    rows = []
+    failed = 0
+    for word in words:
+        for tag in arab_tools.plausible_tags(word):
+            try:
+                rows.append([word, tag, *arab_tools.lookup_word(word, tag)])
+            except analysis_errors as e:
+                failed += 1
+                print(f"{word} ({tag}): {type(e).__name__}: {e}", file=sys.stderr)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(
+            {"version": arab_tools.analysis_key(), "words": rows},
+            f,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+    print(f"{len(words)} words, {len(rows)} analyses, {failed} failed")
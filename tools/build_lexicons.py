@@ -0,0 +1,35 @@
+"""
+Compiles the lexicons of data.py into mapped lexicons (see lexicons.py),
+which the server reads instead of the JSON files when MAPPED_LEXICONS is set
+
+A mapped lexicon is only used as long as its source files don't change
+
+Usage: py tools/build_lexicons.py [-o data/lexicons] [names ...]
+"""
+
+import argparse
+import os
+import time
+
+import _common  # noqa: F401 (puts the repository on the import path)
+
+import data
+import lexicons
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("names", nargs="*", default=[*data.lexicon_sources])
+    parser.add_argument("-o", "--output", default="data/lexicons")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    for name in args.names:
+        start = time.perf_counter()
+        path = os.path.join(args.output, f"{name}.lex")
+        count = lexicons.write_mapped(
+            path, getattr(data, name), data.lexicon_sources[name]
+        )
+        size = os.path.getsize(path) / 2**20
+        print(
+            f"{name}: {count} keys, {size:.1f} MiB, {time.perf_counter() - start:.1f}s"
+        )
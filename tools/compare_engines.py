@@ -0,0 +1,57 @@
+"""
+Compares the output and the throughput of the regex and the automaton engine
+
+Usage: py tools/compare_engines.py [corpus files]; one text per line
+"""
+
+import sys
+import time
+
+from _common import analysis_errors, default_corpora, error_prefix, read_corpus
+
+from data_types import IJMESProfile, Profile
+from trans import render_token, transliterate, transliterate_ijmes
+
+profiles = [
+    (transliterate, Profile()),
+    (transliterate, Profile(pausa=True, double_vowels=False)),
+    (transliterate, Profile(ta_marbutah=True, diphthongs=True, nisba=False)),
+    (transliterate_ijmes, IJMESProfile()),
+    (transliterate_ijmes, IJMESProfile(is_name=True, diphthongs=True)),
+]
+
+
+def run(texts: list[str], engine: str) -> tuple[list[str], float]:
+    outputs = []
+    # the rendering memo would otherwise hide the engines
+    render_token.cache.clear()
+    start = time.perf_counter()
+    for function, profile in profiles:
+        for text in texts:
+            try:
+                outputs.append(function(text, profile, engine=engine))
+            except analysis_errors as e:
+                # compared like an output, both engines should fail alike
+                outputs.append(f"{error_prefix}{type(e).__name__}: {e}")
+    return outputs, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    texts = [
+        text for path in sys.argv[1:] or default_corpora for text in read_corpus(path)
+    ]
+    # warm up the analysis caches (and the automaton's memoized decisions)
+    # so that only the rendering is compared
+    run(texts, "regex")
+    run(texts, "automaton")
+    regex, regex_time = run(texts, "regex")
+    automaton, automaton_time = run(texts, "automaton")
+    mismatches = [(r, a) for r, a in zip(regex, automaton) if r != a]
+    errors = [output for output in regex if output.startswith(error_prefix)]
+    for r, a in mismatches:
+        print(f"regex:     {r}\nautomaton: {a}\n")
+    print(f"{len(regex)} transliterations, {len(mismatches)} mismatches")
+    if errors:
+        print(f"{len(errors)} failed, e.g. {errors[0]}")
+    print(f"regex:     {regex_time:.3f}s")
+    print(f"automaton: {automaton_time:.3f}s")
@@ -0,0 +1,78 @@
+"""
+Compares the lexicon backends (the JSON files, the mapped lexicons and the
+SQLite databases) through arab_tools.lookup_word: the results, the time to the
+first analysis, the time to analyze the words of the corpora and the memory
+
+Every backend runs in a fresh process. The mapped lexicons have to be built
+first (tools/build_lexicons.py)
+
+Usage: py tools/compare_lexicons.py [corpus files]; one text per line
+"""
+
+import hashlib
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from _common import analysis_errors, default_corpora, read_corpus
+
+import data
+
+backends = {
+    "json": lambda: None,
+    "mapped": lambda: data.use_mapped_lexicons("data/lexicons"),
+    "sqlite": lambda: data.use_sqlite_lexicons(),
+}
+
+
+def measure(backend: str, corpora: list[str]) -> dict:
+    start = time.perf_counter()
+    backends[backend]()
+    import arab_tools
+
+    # only the lexicons should answer
+    arab_tools.frequent_words.clear()
+    arab_tools.lookup_word("كتاب", "n")
+    first = time.perf_counter() - start
+    words = [
+        word
+        for path in corpora
+        for text in read_corpus(path)
+        for word in data.token_pattern.findall(text)
+    ]
+    results = hashlib.sha1()
+    failed = 0
+    start = time.perf_counter()
+    for word in dict.fromkeys(words):
+        for tag in arab_tools.plausible_tags(word):
+            try:
+                result = arab_tools.lookup_word(word, tag)
+            except analysis_errors as e:
+                # part of the results, the backends should fail alike
+                failed += 1
+                result = f"{type(e).__name__}: {e}"
+            results.update(repr(result).encode())
+    return {
+        "first analysis (s)": round(first, 2),
+        "words (s)": round(time.perf_counter() - start, 2),
+        "max rss (MiB)": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+        "results": results.hexdigest()[:12],
+        "failed": failed,
+    }
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--backend"]:
+        print(json.dumps(measure(sys.argv[2], sys.argv[3:])))
+        sys.exit()
+    corpora = sys.argv[1:] or default_corpora
+    for backend in backends:
+        output = subprocess.run(
+            [sys.executable, __file__, "--backend", backend, *corpora],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        print(backend, json.loads(output.splitlines()[-1]))
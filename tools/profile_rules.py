@@ -0,0 +1,36 @@
+"""
+Profiles which rules fire on a corpus and writes the report
+
+Usage: py tools/profile_rules.py [-o report.txt|report.json] [corpus files]
+"""
+
+import argparse
+import sys
+
+from _common import analysis_errors, default_corpora, read_corpus
+from compare_engines import profiles
+
+from rules import profile_rules
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("corpora", nargs="*", default=default_corpora)
+    parser.add_argument("-o", "--output", help="write the report to this file")
+    args = parser.parse_args()
+
+    texts = [text for path in args.corpora for text in read_corpus(path)]
+    failed = 0
+    with profile_rules() as profiler:
+        for function, profile in profiles:
+            for text in texts:
+                try:
+                    function(text, profile)
+                except analysis_errors as e:
+                    failed += 1
+                    print(f"{text[:40]}: {type(e).__name__}: {e}", file=sys.stderr)
+    if failed:
+        print(f"{failed} of {len(texts) * len(profiles)} failed", file=sys.stderr)
+    if args.output:
+        profiler.dump(args.output)
+    else:
+        print(profiler.report())
@@ -0,0 +1,125 @@
+"""
+Measures the cold start of the server and checks it against the budget
+in tools/startup_budget.json:
+
+- the import time of every module of this repository that the server imports,
+  each imported first in a fresh process (python -X importtime), so that it
+  includes everything it needs no matter which module imports it first
+- the time from starting to import `trans` to the first transliteration
+
+The budget is kept in multiples of a baseline that is measured in the same run
+(importing a fixed set of standard library modules and decoding a JSON document
+like the lexicons), so that it holds on faster and slower machines.
+Every measurement is the best of `--runs`.
+`--update` stores the current measurements plus some headroom as the new budget
+
+Usage: py tools/startup_budget.py [--runs 3] [--update]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+from _common import root
+
+budget_path = root / "tools" / "startup_budget.json"
+headroom = 2.0
+slack = 0.05
+"""The budget allows `headroom` times the measurement plus `slack` baselines"""
+
+baseline = """
+import time
+start = time.perf_counter()
+import argparse, asyncio, decimal, email.message, http.server, json, logging
+import sqlite3, tarfile, unittest, xml.dom.minidom, zipfile
+rows = [{"word": str(i), "root": "ktb", "freq": i} for i in range(100_000)]
+json.loads(json.dumps(rows))
+print(time.perf_counter() - start)
+"""
+
+first_transliteration = """
+import time
+start = time.perf_counter()
+import trans
+trans.transliterate("قال الرجل إن العلم نور")
+print(time.perf_counter() - start)
+"""
+
+
+def run(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], cwd=root, capture_output=True, text=True, check=True
+    )
+
+
+def own_modules() -> set[str]:
+    return {path.stem for path in root.glob("*.py")} | {
+        path.parent.name for path in root.glob("*/__init__.py")
+    }
+
+
+def import_times(module: str) -> dict[str, float]:
+    """
+    The cumulative import time (in seconds) of the modules of this repository
+    when `module` is imported in a fresh process
+    """
+    stderr = run("-X", "importtime", "-c", f"import {module}").stderr
+    own = own_modules()
+    times = {}
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if name.split(".")[0] in own and cumulative.strip().isdigit():
+            times[name] = int(cumulative) / 1e6
+    return times
+
+
+def measure(runs: int) -> tuple[float, dict[str, float]]:
+    """
+    The baseline and the measurements in seconds
+    """
+    best_baseline = float("inf")
+    measurements: dict[str, float] = {}
+    for _ in range(runs):
+        best_baseline = min(best_baseline, float(run("-c", baseline).stdout))
+        # only the first module of a process has all of its imports to itself
+        times = {module: import_times(module)[module] for module in import_times("app")}
+        times["first transliteration"] = float(run("-c", first_transliteration).stdout)
+        for name, time in times.items():
+            measurements[name] = min(time, measurements.get(name, time))
+    return best_baseline, measurements
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--runs", type=int, default=3)
+    parser.add_argument("--update", action="store_true")
+    args = parser.parse_args()
+
+    unit, measurements = measure(args.runs)
+    if args.update:
+        budget = {
+            name: round(time / unit * headroom + slack, 2)
+            for name, time in sorted(measurements.items())
+        }
+        budget_path.write_text(json.dumps(budget, indent=2) + "\n")
+        print(f"Updated {budget_path.name} (baseline {unit:.3f}s)")
+        sys.exit()
+
+    budget: dict[str, float] = json.loads(budget_path.read_text())
+    print(f"{'baseline':30} {unit:7.3f}s")
+    over = []
+    for name, time in sorted(measurements.items(), key=lambda item: -item[1]):
+        allowed = budget.get(name)
+        relative = time / unit
+        status = "new" if allowed is None else "ok" if relative <= allowed else "OVER"
+        if status == "OVER":
+            over.append(name)
+        limit = "" if allowed is None else f"{allowed:6.2f}x"
+        print(f"{name:30} {time:7.3f}s {relative:6.2f}x  {limit:7}  {status}")
+    if over:
+        sys.exit(f"Over the startup budget: {', '.join(over)}")
@@ -0,0 +1,29 @@
+"""
+Lists the most common words the analysis didn't know (of all workers),
+the candidates for growing the lexicon
+
+Usage: py tools/top_unknown_words.py [-n 100] [-o words.txt] [broken_words.txt]
+"""
+
+import argparse
+
+import _common  # noqa: F401 (puts the repository on the import path)
+
+from unknown_words import read_counts, unknown_words
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", nargs="?", default=unknown_words.path)
+    parser.add_argument("-n", "--count", type=int, default=100)
+    parser.add_argument("-o", "--output", help="write the list to this file")
+    args = parser.parse_args()
+
+    counts = read_counts(args.path, unknown_words.backups)
+    lines = "".join(
+        f"{count}\t{word}\n" for word, count in counts.most_common(args.count)
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(lines)
+    else:
+        print(lines, end="")
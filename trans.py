@@ -1,17 +1,40 @@
+import hashlib
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import suppress
+from copy import copy
+from dataclasses import astuple
+from itertools import chain, repeat
+from threading import Lock
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
 
 from pyarabic import araby
 
 import arab_tools
 import data
 from arab_tools import gen_arab_pattern_match
+from caches import LRUCache, cached
 from data import (
     sentence_stop_marks,
     token_pattern,
 )
-from data_types import IJMESProfile, NameProfile, Profile, Token
+from data_types import (
+    Analysis,
+    Case,
+    IJMESProfile,
+    NameProfile,
+    Pos,
+    Profile,
+    Token,
+)
+from rules import (
+    Engine,
+    active_profiler,
+    dmg_rules,
+    ijmes_rules,
+    transliterate_word,
+)
 
 hum_pattern = gen_arab_pattern_match("هُمْ")
 antum_pattern = gen_arab_pattern_match("أَنْتُمْ")
@@ -39,33 +62,133 @@ bint_pattern = gen_arab_pattern_match("بِنْت")
 kitab_pattern = gen_arab_pattern_match("كتاب")
 
 
-def transliterate(text: str, profile: Profile | NameProfile = Profile()) -> str:
-    """ """
-    profile_is_name = isinstance(profile, NameProfile)
-    # We try to separate the step of gathering information
-    # from the step of actually transliterating using that data
-    # to increase modularity and seperation of concerns
+# Rendering a single analyzed token only depends on its arabic form, its prefix
+# and the rule set flags. Since the words in a text are zipf distributed,
+# most tokens are rendered from the memo (see render_token.cache.stats())
+render_cache_size = 2**16
+
+
+@cached("render_token", render_cache_size)
+def render_token(
+    scheme: str,
+    flags: tuple[bool, ...],
+    arab: str,
+    latin_prefix: str,
+    engine: Engine,
+) -> tuple[str, str]:
+    """
+    Renders an analyzed token and returns the new latin prefix and the latin word
+    """
+    if scheme == "ijmes":
+        word = transliterate_word(ijmes_rules(*flags), arab, engine)
+        if (first_letter := word[0]) in data.sun_letters:
+            if len(word) >= 2 and word[1] == first_letter:
+                word = word[1:]
+        return latin_prefix, word
+    word = transliterate_word(dmg_rules(*flags), arab, engine)
+    # sun letter assimilation
+    if (
+        latin_prefix
+        and latin_prefix[-2] == "l"
+        and (first_letter := word[0]) in data.sun_letters
+    ):
+        latin_prefix = latin_prefix[:-2] + first_letter + "-"
+        if len(word) >= 2 and word[1] == first_letter:
+            word = word[1:]
+    return latin_prefix, word
+
+
+def _render(*args) -> tuple[str, str]:
+    # the rule profiler has to see every word
+    if active_profiler() is not None:
+        return render_token.__wrapped__(*args)
+    return render_token(*args)
+
+
+def render_dmg(
+    flags: tuple[bool, ...], arab: str, latin_prefix: str, engine: Engine = "regex"
+) -> tuple[str, str]:
+    """flags are the arguments to `rules.dmg_rules`"""
+    return _render("dmg", flags, arab, latin_prefix, engine)
+
+
+def render_ijmes(
+    flags: tuple[bool, ...], arab: str, latin_prefix: str, engine: Engine = "regex"
+) -> tuple[str, str]:
+    """flags are the arguments to `rules.ijmes_rules`"""
+    return _render("ijmes", flags, arab, latin_prefix, engine)
+
+
+def analysis_options(profile: Profile | NameProfile) -> tuple:
+    """
+    The settings of the profile the analysis depends on,
+    all others only change the rendering
+    """
+    if isinstance(profile, NameProfile):
+        return ("names", profile.is_book, profile.short_ibn, profile.hu_hi)
+    return ("dmg", profile.pausa, profile.hu_hi)
+
+
+class WaslState(NamedTuple):
+    """
+    What the hamzatul wasl of a token depends on from the tokens before it
+    (which can be in the previous sentence)
+    """
+
+    apply_hamzatul_wasl: bool = False
+    """Whether the previous token ended on a vowel"""
+    next_wasl: str = ""
+    """The helping vowel the previous token gives a hamzatul wasl ("u", "i" or "")"""
+
+
+def clean(text: str) -> str:
     text = text.strip()
     text = araby.strip_tatweel(text)
-    text = data.unicode_cleanup(text)
-    if not text:
-        return ""
-    # tokenization
-    matches = [
-        (token, match.end(), match.start())
-        for match in token_pattern.finditer(text)
-        if (token := text[match.start() : match.end()])
-    ]
-    if not matches:
-        return data.sub_after(text)
-    tokens, ends, starts = zip(*matches)
-    beginning_non_token = data.sub_after(text[: starts[0]])
+    return data.unicode_cleanup(text)
+
+
+# The pipeline: clean -> tokenize -> stem -> resolve -> render
+# Cleaning, tokenizing and stemming (the expensive part) are the same for every
+# scheme. Resolving (pausa, prefixes, special cases, hamzatul wasl, idafah) and
+# rendering are done by the scheme, see `schemes`
 
+Stemming = tuple[str, Pos, Case, bool, str, str, str, bool]
+"""The result of `arab_tools.check_word`"""
+
+
+class Stemmed(NamedTuple):
+    """
+    A tokenized and stemmed text, the input of the scheme specific stages
+    """
+
+    beginning: str
+    """The (transliterated) text before the first token"""
+    sentences: list[list[tuple[Token, Stemming]]]
+
+    def copy(self) -> "Stemmed":
+        """Resolving changes the tokens, so every scheme needs its own"""
+        return Stemmed(
+            self.beginning,
+            [
+                [(copy(token), stemming) for token, stemming in sentence]
+                for sentence in self.sentences
+            ],
+        )
+
+
+def tokenize(text: str) -> tuple[str, list[list[Token]]]:
+    """
+    Splits a cleaned text into the (transliterated) text before the first token
+    and the sentences of tokens
+    """
+    spans = [match.span() for match in token_pattern.finditer(text)]
+    if not spans:
+        return data.sub_after(text), []
+    beginning_non_token = data.sub_after(text[: spans[0][0]])
     tokens = [
-        Token(token, after=text[end:start], is_pausa=profile_is_name or profile.pausa) # type: ignore
-        for token, end, start in zip(tokens, ends, [*starts[1:], len(text)])
+        Token(text, start, end - start, next_start - end)
+        for (start, end), (next_start, _) in zip(spans, [*spans[1:], (len(text), 0)])
     ]
-    # sentence splitting
     sentences: list[list[Token]] = []
     current_sentence: list[Token] = []
     for token in tokens:
@@ -75,10 +198,134 @@ def transliterate(text: str, profile: Profile | NameProfile = Profile()) -> str:
             current_sentence = []
     if current_sentence:
         sentences.append(current_sentence)
+    return beginning_non_token, sentences
 
-    apply_hamzatul_wasl = False
-    next_wasl: str = ""
-    for sentence in sentences:
+
+def stem(text: str) -> Stemmed:
+    """
+    Tokenizes and stems an already cleaned text
+    """
+    beginning_non_token, sentences = tokenize(text)
+    return Stemmed(
+        beginning_non_token,
+        [
+            [*zip(sentence, arab_tools.check_sentence(sentence))]
+            for sentence in sentences
+        ],
+    )
+
+
+def split_prefix(
+    arab: str, prefix_suggestion: str, strict: bool = True
+) -> tuple[str, int]:
+    """
+    Finds the prefixes (wa-, fa-, sa-, li-, bi-, ka- and al-) the stemmer suggested
+    in the token
+
+    Returns the latin prefix and its length in the rasm.
+    `strict` also checks the suggested harakat of li-, bi- and ka-
+    """
+    latin_prefix = ""
+    rasm, harakat = arab_tools.separate(arab)
+    sug_rasm, sug_harakat = arab_tools.separate(prefix_suggestion)
+    i = 0  # the index in the rasm
+
+    def get_rasm(i: int) -> str:
+        return sug_rasm[i] if sug_rasm[i] == rasm[i] else "___"
+
+    def check_haraka(i: int, haraka: str, strict: bool = True) -> bool:
+        return (not harakat[i] or harakat[i] == haraka) and (
+            not strict or not sug_harakat[i] or sug_harakat[i] == haraka
+        )
+
+    with suppress(IndexError):
+        # wa- and fa- prefix
+        if (conjunction := get_rasm(i)) in "فو" and check_haraka(i, data.fatha):
+            latin_prefix += ("w" if conjunction == "و" else "f") + "a-"
+            i += 1
+        # sa- prefix
+        next_letter = get_rasm(i)
+        if next_letter == "س" and check_haraka(i, data.fatha):
+            latin_prefix += "sa-"
+            i += 1
+        # li-, bi-, ka- and then al- prefix
+        elif next_letter in "لبك":
+            if next_letter in "لب" and check_haraka(i, data.kasra, strict):
+                latin_prefix += ("l" if next_letter == "ل" else "b") + "i-"
+                i += 1
+                if (
+                    next_letter == "ل"
+                    and rasm[i] == "ل"
+                    and check_haraka(i, data.sukun, strict)
+                ):
+                    latin_prefix += "l-"
+                    i += 1
+            elif next_letter == "ك" and check_haraka(i, data.fatha, strict):
+                latin_prefix += "ka-"
+                i += 1
+        if (
+            get_rasm(i) == "ا"
+            and check_haraka(i, "")
+            and get_rasm(i + 1) == "ل"
+            and check_haraka(i + 1, data.sukun)
+        ):
+            latin_prefix += "al-" if not i else "l-"
+            i += 2
+    return latin_prefix, i
+
+
+def wasl_vowel(arab: str) -> str:
+    """
+    Guesses the helping vowel of a token that starts with a hamzatul wasl
+    (without the alif and without a haraka)
+    """
+    if araby.separate(araby.strip_lastharaka(arab))[1][1] == data.damma:
+        return "u"
+    elif arab[0] == "ل":  # TODO: and not matches something else
+        return "a"
+    return "i"
+
+
+def analyze(text: str, profile: Profile | NameProfile = Profile()) -> Analysis:
+    """
+    Tokenizes and analyzes the text
+
+    Only the `analysis_options` of the profile are used
+    """
+    return analyze_clean(clean(text), profile)[0]
+
+
+def analyze_clean(
+    text: str,
+    profile: Profile | NameProfile = Profile(),
+    state: WaslState = WaslState(),
+) -> tuple[Analysis, WaslState]:
+    """
+    Analyzes an already cleaned text that follows text that ended in the given state
+
+    Also returns the state at the end of the text
+    """
+    return resolve_dmg(stem(text), profile, state)
+
+
+def resolve_dmg(
+    stemmed: Stemmed,
+    profile: Profile | NameProfile = Profile(),
+    state: WaslState = WaslState(),
+) -> tuple[Analysis, WaslState]:
+    """
+    The DMG (and names) analysis of a stemmed text that follows text that ended in
+    the given state
+
+    Also returns the state at the end of the text
+    """
+    profile_is_name = isinstance(profile, NameProfile)
+    is_pausa = profile_is_name or profile.pausa  # type: ignore
+    tokens: list[Token] = []
+    apply_hamzatul_wasl, next_wasl = state
+    for stemmed_sentence in stemmed.sentences:
+        sentence = [token for token, _ in stemmed_sentence]
+        tokens += sentence
         sentence[-1].is_end_of_sentence = True
 
         # names specific:
@@ -86,12 +333,10 @@ def transliterate(text: str, profile: Profile | NameProfile = Profile()) -> str:
         # and the second if the first is "kitab"
         if profile_is_name and profile.is_book:
             sentence[0].is_name = True
-            if len(sentence) > 1 and kitab_pattern(tokens[0].arab):
-                tokens[1].is_name = True
+            if len(sentence) > 1 and kitab_pattern(sentence[0].arab):
+                sentence[1].is_name = True
 
-        # word analysis and stemming
-        stemmed_words = [*arab_tools.check_sentence(sentence)]
-        for token_i, (token, stemming) in enumerate(zip(sentence, stemmed_words)):
+        for token_i, (token, stemming) in enumerate(stemmed_sentence):
             (
                 token.lemma,
                 token.pos,
@@ -102,6 +347,7 @@ def transliterate(text: str, profile: Profile | NameProfile = Profile()) -> str:
                 token.suffix,
                 _,
             ) = stemming
+            token.is_pausa = is_pausa
             if profile_is_name and not profile.is_book:
                 token.is_name = True
             assert token.pos in ("noun", "verb", "stopword", "")
@@ -117,52 +363,8 @@ def transliterate(text: str, profile: Profile | NameProfile = Profile()) -> str:
 
             # getting the prefix
             rasm, harakat = arab_tools.separate(token.arab)
-            sug_rasm, sug_harakat = arab_tools.separate(prefix_suggestion)
-            i = 0  # the index in the rasm
-
-            def get_rasm(i: int) -> str:
-                return sug_rasm[i] if sug_rasm[i] == rasm[i] else "___"
-
-            def check_haraka(i: int, haraka: str) -> bool:
-                return (not harakat[i] or harakat[i] == haraka) and (
-                    not sug_harakat[i] or sug_harakat[i] == haraka
-                )
-
-            with suppress(IndexError):
-                # wa- and fa- prefix
-                if (conjunction := get_rasm(i)) in "فو" and check_haraka(i, data.fatha):
-                    token.latin_prefix += ("w" if conjunction == "و" else "f") + "a-"
-                    i += 1
-                # sa- prefix
-                next_letter = get_rasm(i)
-                if next_letter == "س" and check_haraka(i, data.fatha):
-                    token.latin_prefix += "sa-"
-                    i += 1
-                # li-, bi-, ka- and then al- prefix
-                elif next_letter in "لبك":
-                    if next_letter in "لب" and check_haraka(i, data.kasra):
-                        token.latin_prefix += (
-                            "l" if next_letter == "ل" else "b"
-                        ) + "i-"
-                        i += 1
-                        if (
-                            next_letter == "ل"
-                            and rasm[i] == "ل"
-                            and check_haraka(i, data.sukun)
-                        ):
-                            token.latin_prefix += "l-"
-                            i += 1
-                    elif next_letter == "ك" and check_haraka(i, data.fatha):
-                        token.latin_prefix += "ka-"
-                        i += 1
-                if (
-                    get_rasm(i) == "ا"
-                    and check_haraka(i, "")
-                    and get_rasm(i + 1) == "ل"
-                    and check_haraka(i + 1, data.sukun)
-                ):
-                    token.latin_prefix += "al-" if not i else "l-"
-                    i += 2
+            latin_prefix, i = split_prefix(token.arab, prefix_suggestion)
+            token.latin_prefix += latin_prefix
 
             # with suppress(IndexError):
             #     def check_haraka(i: int, haraka: str) -> bool:
@@ -307,16 +509,7 @@ def transliterate(text: str, profile: Profile | NameProfile = Profile()) -> str:
                     if has_haraka:
                         token.arab = token.arab[1:]
                 elif not has_haraka:
-                    if (
-                        araby.separate(araby.strip_lastharaka(token.arab))[1][1]
-                        == data.damma
-                    ):
-                        haraka = "u"
-                    elif token.arab[0] == "ل":  # TODO: and not matches something else
-                        haraka = "a"
-                    else:
-                        haraka = "i"
-                    token.arab = (prev_wasl or haraka) + token.arab
+                    token.arab = (prev_wasl or wasl_vowel(token.arab)) + token.arab
 
         # idafah
         for token, next_token in zip(sentence, sentence[1:]):
@@ -342,52 +535,429 @@ def transliterate(text: str, profile: Profile | NameProfile = Profile()) -> str:
                 token.latin_after = ""
                 next_token.is_name = False
 
-    # transliteration
-    for token in tokens:
-        word = token.arab
-        # char mapping
-        char_map = (
-            data.subs
-            | data.vowel_map
-            | (
-                {
-                    "(?<=[āūī])ة$": "h",
-                    "ة$": ("h" if profile.ta_marbutah else ""),
-                }
-                if not token.is_idafah
-                else {}
-            )
-            | (data.begin_hamza_map if not profile.begin_hamza else {})
-            | data.con_map
+    return Analysis(stemmed.beginning, tokens), WaslState(
+        apply_hamzatul_wasl, next_wasl
+    )
+
+
+def render(
+    analysis: Analysis,
+    profile: Profile | NameProfile = Profile(),
+    engine: Engine = "regex",
+) -> str:
+    """
+    Renders an analysis with the rendering settings of the profile
+    """
+    results = [analysis.beginning]
+    for token in analysis.tokens:
+        latin_prefix, latin = render_dmg(
+            (
+                profile.ta_marbutah,
+                profile.begin_hamza,
+                profile.diphthongs,
+                profile.double_vowels,
+                profile.nisba or token.is_nisba,
+                token.is_idafah,
+            ),
+            token.arab,
+            token.latin_prefix,
+            engine,
         )
-        if profile.diphthongs:
-            char_map |= data.diphthong_map
-        if not profile.double_vowels:
-            char_map |= data.double_vowels_map
-        if profile.nisba or token.is_nisba:
-            char_map |= data.nisba_map
-        rules = [(re.compile(arab), latin) for arab, latin in char_map.items()]
-        cont: bool = True
-        while cont:
-            cont = False
-            for pattern, replace in rules:
-                word, n = pattern.subn(replace, word)
-                cont = cont or bool(n)
-                # if n:
-                #     print(word, pattern, replace)
-        # sun letter assimilation
-        prefix = token.latin_prefix
-        if (
-            prefix
-            and prefix[-2] == "l"
-            and (first_letter := word[0]) in data.sun_letters
+        results.append(token.render(latin_prefix, latin))
+    return "".join(results)
+
+
+def transliterate(
+    text: str,
+    profile: Profile | NameProfile = Profile(),
+    engine: Engine = "regex",
+    workers: int = 1,
+) -> str:
+    """
+    `workers` > 1 analyzes and renders the sentences of long texts in that many
+    processes (see `transliterate_parallel`)
+    """
+    if workers > 1:
+        return transliterate_parallel(text, profile, engine, workers)
+    return render(analyze(text, profile), profile, engine)
+
+
+# Streaming
+# The text is cleaned chunk by chunk and split into sentences as soon as the first
+# token of the next sentence starts. The end of a chunk is held back if cleaning
+# might depend on the next chunk: whitespace (stripped at the end of the text),
+# tatweels and characters that start a sequence in `data.unicode_cleanup_map`
+_cleanup_starts = {key[0] for key in data.unicode_cleanup_map if len(key) > 1}
+
+
+def _held_back(c: str) -> bool:
+    return c.isspace() or c == araby.TATWEEL or c in _cleanup_starts
+
+
+def _sentence_starts(
+    text: str, resume: int = 0, previous_end: int | None = None
+) -> tuple[list[int], int, int | None]:
+    """
+    The starts of the sentences in a cleaned text (but the first) from `resume` on,
+    where `previous_end` is the end of the token before (if any)
+
+    Also returns where to resume when more text follows and the end of the token
+    before that: the last token might still go on, so it is scanned again
+    """
+    starts = []
+    before_last = previous_end
+    last = None
+    for last in token_pattern.finditer(text, resume):
+        if previous_end is not None and any(
+            stop_mark in data.sub_after(text[previous_end : last.start()])
+            for stop_mark in sentence_stop_marks
         ):
-            token.latin_prefix = prefix[:-2] + first_letter + "-"
-            if len(word) >= 2 and word[1] == first_letter:
-                word = word[1:]
-        token.latin = word
+            starts.append(last.start())
+        before_last, previous_end = previous_end, last.end()
+    if last is None:
+        return starts, len(text), previous_end
+    return starts, last.start(), before_last
+
+
+def _split_sentences(text: str) -> list[str]:
+    """
+    Splits a cleaned text right before the first token of every sentence
+    """
+    starts, _, _ = _sentence_starts(text)
+    return [text[start:stop] for start, stop in zip([0, *starts], [*starts, None])]
+
+
+max_sentence_length = 10_000
+"""Longer sentences are cut before their last token while streaming"""
+
 
-    return beginning_non_token + "".join(token.result for token in tokens)
+def clean_sentences(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Cleans a text given in chunks like `clean` and yields its sentences
+
+    Only the current sentence is held in memory and every chunk only scans the
+    text after the last complete token. A sentence that grows longer than
+    `max_sentence_length` (text without stop marks) is cut before its last token
+    """
+    raw = ""  # not cleaned yet
+    text = ""  # cleaned but not complete yet
+    # where to continue looking for sentence starts in `text`
+    # and the end of the token before
+    resume, previous_end = 0, None
+    started = False  # whether the text started (only its beginning is stripped)
+    for chunk in chunks:
+        raw += chunk
+        if not started:
+            raw = raw.lstrip()
+            started = bool(raw)
+        i = len(raw)
+        while i and _held_back(raw[i - 1]):
+            i -= 1
+        if not i:
+            continue
+        text += data.unicode_cleanup(araby.strip_tatweel(raw[:i]))
+        raw = raw[i:]
+        starts, resume, previous_end = _sentence_starts(text, resume, previous_end)
+        if not starts and len(text) > max_sentence_length:
+            starts = [resume or len(text)]
+        for start, stop in zip([0, *starts], starts):
+            yield text[start:stop]
+        if starts:
+            cut = starts[-1]
+            text = text[cut:]
+            resume -= cut
+            if previous_end is not None:
+                previous_end = previous_end - cut if previous_end > cut else None
+    text += data.unicode_cleanup(araby.strip_tatweel(raw.rstrip()))
+    if text:
+        yield from _split_sentences(text)
+
+
+def transliterate_stream(
+    chunks: Iterable[str],
+    profile: Profile | NameProfile = Profile(),
+    engine: Engine = "regex",
+) -> Iterator[str]:
+    """
+    Transliterates a text given in chunks sentence by sentence
+
+    The output joined is the same as the transliteration of the joined chunks
+    """
+    state = WaslState()
+    for sentence in clean_sentences(chunks):
+        analysis, state = analyze_clean(sentence, profile, state)
+        yield render(analysis, profile, engine)
+
+
+def transliterate_many(
+    texts: Iterable[str],
+    profile: Profile | NameProfile = Profile(),
+    engine: Engine = "regex",
+) -> list[str]:
+    """
+    Transliterates many (short) texts at once
+
+    Identical texts and identical sentences with the same incoming wasl state are
+    only analyzed and rendered once, identical tokens are rendered once anyway
+    """
+    texts = list(texts)
+    results: dict[str, str] = {}
+    sentences: dict[tuple[str, WaslState], tuple[str, WaslState]] = {}
+    for text in texts:
+        if text in results:
+            continue
+        outputs = []
+        state = WaslState()
+        for sentence in _split_sentences(clean(text)):
+            if (rendered := sentences.get((sentence, state))) is None:
+                analysis, next_state = analyze_clean(sentence, profile, state)
+                rendered = sentences[sentence, state] = (
+                    render(analysis, profile, engine),
+                    next_state,
+                )
+            output, state = rendered
+            outputs.append(output)
+        results[text] = "".join(outputs)
+    return [results[text] for text in texts]
+
+
+# Parallel transliteration
+# The sentences are split into contiguous shards which are transliterated in a
+# process pool, each starting with the default wasl state. A sentence whose real
+# incoming state differs (usually only the first of a shard) is done again.
+# There is one pool per worker count, so that no pool is shut down under a
+# thread that is still using it
+_pools: dict[int, ProcessPoolExecutor] = {}
+_pools_lock = Lock()
+shards_per_worker = 4
+min_shard_length = 2000
+"""Shorter texts are transliterated in one shard"""
+
+
+def _init_worker():
+    # load the lexicons and the stemmers before the first shard arrives
+    transliterate("بِسْمِ اللهِ الرَّحْمَنِ الرَّحِيمِ")
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    with _pools_lock:
+        if (pool := _pools.get(workers)) is None:
+            pool = _pools[workers] = ProcessPoolExecutor(
+                workers, initializer=_init_worker
+            )
+        return pool
+
+
+def _transliterate_shard(
+    sentences: list[str], profile: Profile | NameProfile, engine: Engine
+) -> list[tuple[str, WaslState, WaslState]]:
+    """
+    Returns the output, the assumed incoming state and the outgoing state
+    of every sentence
+    """
+    results = []
+    state = WaslState()
+    for sentence in sentences:
+        analysis, next_state = analyze_clean(sentence, profile, state)
+        results.append((render(analysis, profile, engine), state, next_state))
+        state = next_state
+    return results
+
+
+def _shards(sentences: list[str], count: int) -> list[list[str]]:
+    """
+    Splits the sentences into at most `count` contiguous shards of similar length
+    """
+    size = max(sum(map(len, sentences)) / count, min_shard_length)
+    shards: list[list[str]] = [[]]
+    length = 0
+    for sentence in sentences:
+        if length >= size:
+            shards.append([])
+            length = 0
+        shards[-1].append(sentence)
+        length += len(sentence)
+    return shards
+
+
+def transliterate_parallel(
+    text: str,
+    profile: Profile | NameProfile = Profile(),
+    engine: Engine = "regex",
+    workers: int = 2,
+) -> str:
+    """
+    Transliterates the text in `workers` processes
+    """
+    sentences = _split_sentences(clean(text))
+    shards = _shards(sentences, workers * shards_per_worker)
+    if len(shards) == 1:
+        return transliterate(text, profile, engine)
+    pool = _get_pool(workers)
+    results = pool.map(_transliterate_shard, shards, repeat(profile), repeat(engine))
+    outputs = []
+    state = WaslState()
+    for sentence, (output, assumed, next_state) in zip(
+        sentences, chain.from_iterable(results)
+    ):
+        if assumed != state:
+            analysis, next_state = analyze_clean(sentence, profile, state)
+            output = render(analysis, profile, engine)
+        outputs.append(output)
+        state = next_state
+    return "".join(outputs)
+
+
+# Analyses are cached by the hash of the text, so that a client can render a text
+# with another profile without sending and analyzing it again
+document_cache_size = 64
+
+
+class _Document(NamedTuple):
+    text: str
+    analyses: dict[tuple, Analysis]
+
+
+_documents: LRUCache[str, _Document] = LRUCache(document_cache_size, "documents")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _cached_analysis(key: str, text: str, profile: Profile | NameProfile) -> Analysis:
+    options = analysis_options(profile)
+    if (document := _documents.get(key)) and (
+        analysis := document.analyses.get(options)
+    ):
+        return analysis
+    analysis = analyze(text, profile)
+    _documents.setdefault(key, _Document(text, {})).analyses[options] = analysis
+    return analysis
+
+
+def cached_analysis(
+    text: str, profile: Profile | NameProfile = Profile()
+) -> tuple[str, Analysis]:
+    """
+    Analyzes the text or reuses a cached analysis of it
+
+    Also returns the content hash with which `rerender` can render the text again
+    """
+    key = content_hash(text)
+    return key, _cached_analysis(key, text, profile)
+
+
+def rerender(
+    key: str, profile: Profile | NameProfile = Profile(), engine: Engine = "regex"
+) -> str | None:
+    """
+    Renders the text with the content hash again with the profile
+
+    Only analyzes it again if the analysis options changed.
+    Returns None if the text isn't cached (anymore)
+    """
+    if (document := _documents.get(key)) is None:
+        return None
+    return render(_cached_analysis(key, document.text, profile), profile, engine)
+
+
+# Incremental transliteration
+# Sentences are analyzed once per text, incoming wasl state and analysis options.
+# Every live document remembers from what it was rendered last time,
+# so that only the sentences that changed have to be sent back
+sentence_cache_size = 2**12
+live_document_count = 256
+
+
+class _RenderedSentence(NamedTuple):
+    key: tuple
+    """The sentence, its incoming state, the profile and the engine"""
+    output: str
+    state: WaslState
+    """The outgoing state"""
+
+
+_sentences: LRUCache[tuple, tuple[Analysis, WaslState]] = LRUCache(
+    sentence_cache_size, "sentences"
+)
+
+
+class _LiveDocument(NamedTuple):
+    revision: int
+    """How many answers for the document the client has applied"""
+    sentences: list[_RenderedSentence]
+
+
+_live_documents: LRUCache[str, _LiveDocument] = LRUCache(
+    live_document_count, "live_documents"
+)
+
+
+def analyze_sentence(
+    sentence: str,
+    profile: Profile | NameProfile = Profile(),
+    state: WaslState = WaslState(),
+) -> tuple[Analysis, WaslState]:
+    """
+    `analyze_clean` of a single sentence (see `clean_sentences`), cached
+    """
+    key = (sentence, state, analysis_options(profile))
+    if (result := _sentences.get(key)) is None:
+        result = _sentences.put(key, analyze_clean(sentence, profile, state))
+    return result
+
+
+def transliterate_incremental(
+    document: str,
+    text: str,
+    profile: Profile | NameProfile = Profile(),
+    engine: Engine = "regex",
+    revision: int | None = None,
+    count: int = 0,
+) -> tuple[int, int, list[str]]:
+    """
+    Transliterates the current text of a document that is edited live
+
+    Returns `(start, stop, outputs)`: the sentence outputs of the last call for the
+    same document in `[start:stop]` are replaced by `outputs`.
+    All sentence outputs joined are the transliteration of the text
+
+    `revision` is how many answers the client has applied and `count` how many
+    sentence outputs it holds. If this process doesn't know that revision
+    (its state was evicted or another worker answered in between),
+    all outputs replace the `count` of the client
+    """
+    live = _live_documents.get(document)
+    stale = revision is not None and (live is None or live.revision != revision)
+    previous = [] if live is None or stale else live.sentences
+    known = {sentence.key: sentence for sentence in previous}
+    profile_key = (type(profile).__name__, astuple(profile), engine)
+    sentences: list[_RenderedSentence] = []
+    state = WaslState()
+    for sentence in clean_sentences([text]):
+        key = (sentence, state, profile_key)
+        if (rendered := known.get(key)) is None:
+            analysis, next_state = analyze_sentence(sentence, profile, state)
+            rendered = _RenderedSentence(
+                key, render(analysis, profile, engine), next_state
+            )
+        sentences.append(rendered)
+        state = rendered.state
+    _live_documents.put(document, _LiveDocument((revision or 0) + 1, sentences))
+    if stale:
+        return 0, count, [sentence.output for sentence in sentences]
+
+    # only send what is between the unchanged beginning and end
+    same = min(len(previous), len(sentences))
+    start = 0
+    while start < same and previous[start].key == sentences[start].key:
+        start += 1
+    end = 0
+    while end < same - start and previous[-1 - end].key == sentences[-1 - end].key:
+        end += 1
+    outputs = [sentence.output for sentence in sentences[start : len(sentences) - end]]
+    return start, len(previous) - end, outputs
 
 
 name_connector_patterns = [
@@ -395,45 +965,19 @@ name_connector_patterns = [
 ]
 
 
-def transliterate_ijmes(text: str, profile: IJMESProfile = IJMESProfile()) -> str:
-    text = text.strip()
-    text = araby.strip_tatweel(text)
-    text = data.unicode_cleanup(text)
-    if not text:
-        return ""
-    # tokenization
-    matches = [
-        (token, match.end(), match.start())
-        for match in token_pattern.finditer(text)
-        if (token := text[match.start() : match.end()])
-    ]
-    if not matches:
-        return data.sub_after(text)
-    tokens, ends, starts = zip(*matches)
-    beginning_non_token = data.sub_after(text[: starts[0]])
-
-    tokens = [
-        Token(token, after=text[end:start], is_pausa=True)
-        for token, end, start in zip(tokens, ends, [*starts[1:], len(text)])
-    ]
-    # sentence splitting
-    sentences: list[list[Token]] = []
-    current_sentence: list[Token] = []
-    for token in tokens:
-        current_sentence.append(token)
-        if any(stop_mark in token.latin_after for stop_mark in sentence_stop_marks):
-            sentences.append(current_sentence)
-            current_sentence = []
-    if current_sentence:
-        sentences.append(current_sentence)
-
+def resolve_ijmes(stemmed: Stemmed, profile: IJMESProfile = IJMESProfile()) -> Analysis:
+    """
+    The IJMES analysis of a stemmed text
+    """
+    tokens: list[Token] = []
     last_was_name = False
-    for sentence in sentences:
+    for stemmed_sentence in stemmed.sentences:
+        sentence = [token for token, _ in stemmed_sentence]
+        tokens += sentence
         sentence[-1].is_end_of_sentence = True
 
-        # word analysis and stemming
-        stemmed_words = [*arab_tools.check_sentence(sentence)]
-        for token, stemming in zip(sentence, stemmed_words):
+        for token, stemming in stemmed_sentence:
+            token.is_pausa = True
             (
                 token.lemma,
                 token.pos,
@@ -464,57 +1008,8 @@ def transliterate_ijmes(text: str, profile: IJMESProfile = IJMESProfile()) -> st
 
             # getting the prefix
             rasm, harakat = arab_tools.separate(token.arab)
-            sug_rasm, sug_harakat = arab_tools.separate(prefix_suggestion)
-            i = 0  # the index in the rasm
-
-            def get_rasm(i: int) -> str:
-                return sug_rasm[i] if sug_rasm[i] == rasm[i] else "___"
-
-            def check_haraka(i: int, haraka: str) -> bool:
-                return (not harakat[i] or harakat[i] == haraka) and (
-                    not sug_harakat[i] or sug_harakat[i] == haraka
-                )
-
-            with suppress(IndexError):
-                # wa- and fa- prefix
-                if (conjunction := get_rasm(i)) in "فو" and check_haraka(i, data.fatha):
-                    token.latin_prefix += ("w" if conjunction == "و" else "f") + "a-"
-                    i += 1
-                # sa- prefix
-                next_letter = get_rasm(i)
-                if next_letter == "س" and check_haraka(i, data.fatha):
-                    token.latin_prefix += "sa-"
-                    i += 1
-                # li-, bi-, ka- and then al- prefix
-                elif next_letter in "لبك":
-                    if next_letter in "لب" and (
-                        not harakat[i] or harakat[i] == data.kasra
-                    ):
-                        token.latin_prefix += (
-                            "l" if next_letter == "ل" else "b"
-                        ) + "i-"
-                        i += 1
-                        # lil
-                        if (
-                            next_letter == "ل"
-                            and rasm[i] == "ل"
-                            and (not harakat[i] or harakat[i] == data.sukun)
-                        ):
-                            token.latin_prefix += "l-"
-                            i += 1
-                    elif next_letter == "ك" and (
-                        not harakat[i] or harakat[i] == data.fatha
-                    ):
-                        token.latin_prefix += "ka-"
-                        i += 1
-                if (
-                    get_rasm(i) == "ا"
-                    and check_haraka(i, "")
-                    and get_rasm(i + 1) == "ل"
-                    and check_haraka(i + 1, data.sukun)
-                ):
-                    token.latin_prefix += "al-" if not i else "l-"
-                    i += 2
+            latin_prefix, i = split_prefix(token.arab, prefix_suggestion, strict=False)
+            token.latin_prefix += latin_prefix
 
             token.prefix = arab_tools.join(rasm[:i], harakat[:i])
             token.arab = arab_tools.join(rasm[i:], harakat[i:])
@@ -571,16 +1066,7 @@ def transliterate_ijmes(text: str, profile: IJMESProfile = IJMESProfile()) -> st
                 token.arab = token.arab[1:]
                 has_haraka = token.arab[0] in data.short_vowels
                 if not has_haraka:
-                    if (
-                        araby.separate(araby.strip_lastharaka(token.arab))[1][1]
-                        == data.damma
-                    ):
-                        haraka = "u"
-                    elif token.arab[0] == "ل":  # TODO: and not matches something else
-                        haraka = "a"
-                    else:
-                        haraka = "i"
-                    token.arab = haraka + token.arab
+                    token.arab = wasl_vowel(token.arab) + token.arab
 
         # idafah
         for token, next_token in zip(sentence, sentence[1:]):
@@ -605,38 +1091,79 @@ def transliterate_ijmes(text: str, profile: IJMESProfile = IJMESProfile()) -> st
                 token.latin_after = ""
                 next_token.is_name = False
 
-    # transliteration
-    for token in tokens:
-        word = token.arab
-        # char mapping
-        char_map = (
-            data.subs | data.vowel_map | data.begin_hamza_map | data.ijmes_con_map
+    return Analysis(stemmed.beginning, tokens)
+
+
+def render_ijmes_analysis(
+    analysis: Analysis,
+    profile: IJMESProfile = IJMESProfile(),
+    engine: Engine = "regex",
+) -> str:
+    results = [analysis.beginning]
+    for token in analysis.tokens:
+        latin_prefix, latin = render_ijmes(
+            (profile.diphthongs, profile.is_name, token.is_nisba, token.is_idafah),
+            token.arab,
+            token.latin_prefix,
+            engine,
         )
-        if not token.is_idafah:
-            char_map["ة"] = ""
-        if token.is_nisba:
-            char_map["iyy$"] = "iyya"
-        if profile.diphthongs:
-            char_map |= data.diphthong_map
-        if profile.is_name:
-            char_map |= data.ijmes_name_map
-        rules = [(re.compile(arab), latin) for arab, latin in char_map.items()]
-        cont: bool = True
-        while cont:
-            cont = False
-            for pattern, replace in rules:
-                word, n = pattern.subn(replace, word)
-                cont = cont or bool(n)
-                # if n:
-                #     print(word, pattern, replace)
-        prefix = token.latin_prefix
+        results.append(token.render(latin_prefix, latin))
+    return "".join(results)
 
-        if (first_letter := word[0]) in data.sun_letters:
-            if len(word) >= 2 and word[1] == first_letter:
-                word = word[1:]
-        token.latin = word
 
-    return beginning_non_token + "".join(token.result for token in tokens)
+def transliterate_ijmes(
+    text: str, profile: IJMESProfile = IJMESProfile(), engine: Engine = "regex"
+) -> str:
+    return render_ijmes_analysis(
+        resolve_ijmes(stem(clean(text)), profile), profile, engine
+    )
+
+
+class Scheme(NamedTuple):
+    """
+    How a transliteration scheme resolves a stemmed text and renders the analysis
+    """
+
+    profile: type
+    resolve: Callable[[Stemmed, Any], Analysis]
+    render: Callable[[Analysis, Any, Engine], str]
+
+
+def _resolve_dmg(stemmed: Stemmed, profile: Profile | NameProfile) -> Analysis:
+    return resolve_dmg(stemmed, profile)[0]
+
+
+schemes: dict[str, Scheme] = {
+    "dmg": Scheme(Profile, _resolve_dmg, render),
+    "names": Scheme(NameProfile, _resolve_dmg, render),
+    "ijmes": Scheme(IJMESProfile, resolve_ijmes, render_ijmes_analysis),
+}
+"""The render schemes by name, new schemes can be registered here"""
+
+
+def transliterate_multi(
+    text: str,
+    profiles: dict[str, Profile | NameProfile | IJMESProfile],
+    engine: Engine = "regex",
+) -> dict[str, str]:
+    """
+    Transliterates the text into several schemes at once, for example
+    `transliterate_multi(text, {"dmg": Profile(), "ijmes": IJMESProfile()})`
+
+    The text is only cleaned, tokenized and stemmed once
+    """
+    for name, profile in profiles.items():
+        if not isinstance(profile, schemes[name].profile):
+            raise TypeError(f"{name} needs a {schemes[name].profile.__name__}")
+    stemmed = stem(clean(text))
+    results = {}
+    for i, (name, profile) in enumerate(profiles.items()):
+        scheme = schemes[name]
+        # the last scheme can have the original tokens
+        own = stemmed.copy() if i < len(profiles) - 1 else stemmed
+        results[name] = scheme.render(scheme.resolve(own, profile), profile, engine)
+    return results
+
 
 def transliterate_llm(text: str):
     from huggingface_hub import InferenceClient
@@ -0,0 +1,144 @@
+"""
+Collects the words the analysis doesn't know, which are the candidates
+for growing the lexicon
+
+The words are counted in memory and appended to a file in batches
+by a background thread. Every line of the file is `count<TAB>word`
+"""
+
+import atexit
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock, Thread
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the server runs in a single process
+    fcntl = None
+
+
+class UnknownWords:
+    """
+    A thread-safe counter of unknown words that flushes itself in the background
+
+    At most `max_words` different words are counted per process, the file is
+    rotated (`path.1`, `path.2`, ...) once it's bigger than `max_file_size`.
+    The processes of the server take turns writing with a lock on `path.lock`
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 10.0,
+        max_words: int = 2**16,
+        max_file_size: int = 2**24,
+        backups: int = 3,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_words = max_words
+        self.max_file_size = max_file_size
+        self.backups = backups
+        self.counts: Counter[str] = Counter()
+        """Every word of this process"""
+        self.dropped = 0
+        """How often a word wasn't counted because of `max_words`"""
+        self._pending: Counter[str] = Counter()
+        self._lock = Lock()
+        self._pid = 0
+        atexit.register(self.flush)
+
+    def add(self, word: str):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            if word not in self.counts and len(self.counts) >= self.max_words:
+                self.dropped += 1
+                return
+            self.counts[word] += 1
+            self._pending[word] += 1
+
+    def top(self, n: int | None = None) -> list[tuple[str, int]]:
+        """
+        The most common unknown words of this process
+        """
+        with self._lock:
+            return self.counts.most_common(n)
+
+    def flush(self):
+        """
+        Appends the words counted since the last flush to the file
+        """
+        with self._lock:
+            # a forked process didn't count what it inherited, its parent flushes it
+            if self._pid != os.getpid():
+                return
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return
+        lines = "".join(f"{count}\t{word}\n" for word, count in pending.items())
+        with self._file_lock():
+            self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+    def _start(self):
+        # a forked process starts over, its parent flushes what it inherited
+        self._pid = os.getpid()
+        self.counts.clear()
+        self._pending.clear()
+        Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _rotate(self):
+        try:
+            if os.path.getsize(self.path) < self.max_file_size:
+                return
+        except OSError:
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+def read_counts(path: str, backups: int = 3) -> Counter[str]:
+    """
+    Adds up the counts in the file and its rotated backups
+    (a line with only a word counts once)
+    """
+    counts: Counter[str] = Counter()
+    for file in [path, *(f"{path}.{i}" for i in range(1, backups + 1))]:
+        if not os.path.exists(file):
+            continue
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                count, _, word = line.rstrip("\n").rpartition("\t")
+                if word:
+                    counts[word] += int(count or 1)
+    return counts
+
+
+unknown_words = UnknownWords("broken_words.txt")
@@ -8,18 +8,25 @@ Module for vocalization of Arabic text
 # import json
 
 from contextlib import suppress
-
-import mishkal.tashkeel
+from functools import cache
 
 # import requests
 import data
 from arab_tools import join, separate
 
-vocalizer = mishkal.tashkeel.TashkeelClass("")
+
+@cache
+def vocalizer():
+    """
+    The mishkal vocalizer, which is only imported and built when it's used
+    """
+    import mishkal.tashkeel
+
+    return mishkal.tashkeel.TashkeelClass("")
 
 
 # def vocalize(text: str) -> str:
-#     o = vocalizer.tashkeel(text)
+#     o = vocalizer().tashkeel(text)
 #     o = "".join(c if c.isprintable() else " " for c in o).strip()
 #     return o
 